@@ -0,0 +1,149 @@
+"""
+Historical Backfill - Loads watt_data/*.csv into InfluxDB and rebuilds the daily totals store
+
+Usage: python backfill.py [--start 2012-06-01] [--end 2013-01-13] [--workers N] [--batch-size N]
+"""
+
+import os
+import argparse
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import daily_totals
+import rollups
+import watt_data
+from influx_writer import to_line_protocol
+
+# Measurement name used by the consumer
+MEASUREMENT = "electricity"
+
+
+# Partials of every minute of readings, rows of (minute start, count, sum, sum of squares, min, max)
+def minute_partials(start_timestamp, values):
+    minutes = {}
+    for i, value in enumerate(values):
+        minute = (start_timestamp + i) // 60 * 60
+        partial = minutes.get(minute)
+        if partial is None:
+            minutes[minute] = [1, value, value * value, value, value]
+        else:
+            partial[0] = partial[0] + 1
+            partial[1] = partial[1] + value
+            partial[2] = partial[2] + value * value
+            if value < partial[3]:
+                partial[3] = value
+            if value > partial[4]:
+                partial[4] = value
+    return [(minute, *partial) for minute, partial in minutes.items()]
+
+# Worker process - parse one day file into line protocol, its daily total and its per minute partials
+def parse_day(day, directory, household=None):
+    start_timestamp = watt_data.day_start_timestamp(day)
+    values = [int(value) for value in watt_data.read_day(day, directory)]
+
+    # Row i was measured i secs after midnight
+    lines = [to_line_protocol(MEASUREMENT, start_timestamp + i, value, household) for i, value in enumerate(values)]
+    return day, lines, sum(values), len(values), minute_partials(start_timestamp, values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load historical watt_data files into InfluxDB")
+    parser.add_argument("--start", default=watt_data.FIRST_DAY, help="first day to load (default %(default)s)")
+    parser.add_argument("--end", default=watt_data.LAST_DAY, help="last day to load (default %(default)s)")
+    parser.add_argument("--data-directory", default=watt_data.WATT_DATA_DIRECTORY, help="directory of the day files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parser processes (default: one per core)")
+    parser.add_argument("--batch-size", type=int, default=50000, help="lines per InfluxDB write (default %(default)s)")
+    parser.add_argument("--household", help="household (device) id the data belongs to (default: untagged, stored as \"default\")")
+    parser.add_argument("--skip-totals", action="store_true", help="don't rebuild the daily totals store")
+    parser.add_argument("--rollup-tiers", default="1m,1h,1d", help="rollup tiers to write, empty for none (default %(default)s)")
+    args = parser.parse_args()
+
+    # Imported here so worker processes only load what parse_day needs
+    from dotenv import load_dotenv
+    from influxdb_client import InfluxDBClient, WritePrecision
+    from influxdb_client.client.write_api import SYNCHRONOUS
+
+    load_dotenv()  # take environment variables from .env.
+
+    # InfluxDB config (gzip makes the large batches much smaller on the wire)
+    bucket = os.getenv('INFLUXDB_BUCKET')
+    client = InfluxDBClient(url=os.getenv('INFLUXDB_LOCALHOST_URL', os.getenv('INFLUXDB_URL')),
+                            token=os.getenv('INFLUXDB_TOKEN'), org=os.getenv('INFLUXDB_ORG'),
+                            enable_gzip=True, timeout=120000)
+    write_api = client.write_api(write_options=SYNCHRONOUS)
+
+    totals_conn = None if args.skip_totals else daily_totals.connect()
+
+    days = watt_data.days(args.start, args.end)
+    print("Backfilling {} days with {} workers".format(len(days), args.workers))
+
+    start = time.perf_counter()
+    total_rows = 0
+    write_seconds = 0.0
+    pending = []
+
+    # Days are merged into the rollups in date order, so a window that spans two day files
+    # (e.g. a UTC day) is complete before it is written. Rollups of the loaded range are replaced
+    tiers = rollups.parse_tiers(args.rollup_tiers)
+    aggregator = rollups.RollupAggregator(lambda records: pending.extend(records), tiers, grace=0) if tiers else None
+
+    # Send the pending lines in batches
+    def write(lines):
+        nonlocal write_seconds
+        write_start = time.perf_counter()
+        for i in range(0, len(lines), args.batch_size):
+            write_api.write(bucket=bucket, record=lines[i:i + args.batch_size], write_precision=WritePrecision.S)
+        write_seconds = write_seconds + time.perf_counter() - write_start
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # Keep only a few days in flight so memory stays bounded while parsing runs ahead of the writes
+        futures = deque()
+        remaining = iter(days)
+        for day in remaining:
+            futures.append(executor.submit(parse_day, day, args.data_directory, args.household))
+            if len(futures) >= args.workers * 2:
+                break
+
+        while futures:
+            try:
+                day, lines, usage, rows, minutes = futures.popleft().result()
+            except FileNotFoundError as e:
+                print("Skipping missing file: {}".format(e.filename))
+                day, lines, usage, rows, minutes = None, [], 0, 0, []
+
+            next_day = next(remaining, None)
+            if next_day is not None:
+                futures.append(executor.submit(parse_day, next_day, args.data_directory, args.household))
+
+            pending.extend(lines)
+            if aggregator is not None and minutes:
+                for minute in minutes:
+                    aggregator.add_partial(args.household, *minute)
+                aggregator.flush()
+            if len(pending) >= args.batch_size:
+                full = len(pending) - len(pending) % args.batch_size
+                write(pending[:full])
+                pending = pending[full:]
+
+            if day is not None and totals_conn is not None:
+                daily_totals.replace_days(totals_conn, [(day, usage, rows * daily_totals.RUNTIME_PER_READING)],
+                                          args.household or daily_totals.DEFAULT_HOUSEHOLD)
+
+            total_rows = total_rows + rows
+            elapsed = time.perf_counter() - start
+            if day is not None:
+                print("{}: {} rows, {} total, {:.0f} rows/sec".format(day, rows, total_rows, total_rows / elapsed))
+
+    if aggregator is not None:
+        aggregator.flush(closing=True)
+    write(pending)
+    client.close()
+
+    elapsed = time.perf_counter() - start
+    print("Backfilled {} rows of {} days in {:.1f} sec ({:.0f} rows/sec, {:.1f} sec writing to InfluxDB)".format(
+        total_rows, len(days), elapsed, total_rows / elapsed if elapsed else 0, write_seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Insights Benchmark - Times the server-side (Flux) and client-side aggregation of the Insights statistics on the same data
+
+Usage: python bench_insights.py [--repeat 3] [--household ID]
+"""
+
+import os
+import argparse
+import time
+
+from dotenv import load_dotenv
+from influxdb_client import InfluxDBClient
+
+import daily_totals
+import insights
+
+STATISTICS = ("std", "max", "min", "morning", "noon", "afternoon", "night")
+RANGES = (("week", "-168h"), ("month", "-730h"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark server vs client Insights aggregation")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per range and path (default %(default)s)")
+    parser.add_argument("--household", default=None, help="household id (default: HOUSEHOLD_ID or the default household)")
+    args = parser.parse_args()
+
+    load_dotenv()  # take environment variables from .env.
+    org = os.getenv('INFLUXDB_ORG')
+    household = args.household or os.getenv('HOUSEHOLD_ID', daily_totals.DEFAULT_HOUSEHOLD)
+    flux_filter = insights.household_filter(household, daily_totals.DEFAULT_HOUSEHOLD)
+
+    client = InfluxDBClient(url=os.getenv('INFLUXDB_LOCALHOST_URL'),
+                            token=os.getenv('INFLUXDB_TOKEN'), org=org, timeout=600000)
+    query_api = client.query_api()
+
+    for name, range_start in RANGES:
+        results = {}
+        for aggregation in (insights.SERVER, insights.CLIENT):
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                results[aggregation] = insights.query_range_statistics(query_api, org, range_start, flux_filter, aggregation)
+                timings.append(time.perf_counter() - start)
+            print("{:<5} {:<6}: best {:.3f} sec, mean {:.3f} sec".format(
+                name, aggregation, min(timings), sum(timings) / len(timings)))
+
+        # Both paths should agree (up to float summation order)
+        for statistic, server, client_side in zip(STATISTICS, results[insights.SERVER], results[insights.CLIENT]):
+            print("      {:<9} server {:>14.4f} client {:>14.4f}".format(statistic, float(server), float(client_side)))
+
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
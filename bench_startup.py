@@ -0,0 +1,123 @@
+"""
+Startup Benchmark - Times cold imports of the app with `python -X importtime` and reports the cost per module
+
+Every run imports watt_matters_app in a new interpreter, then the modules main() loads on demand (matplotlib with
+the TkAgg backend, the InfluxDB client), so both the import of the app and the startup it defers are measured.
+The median of the runs is reported per module. --save writes them to a JSON file, --compare fails (exit code 1)
+when the total, an imported module or one of the app's own modules got slower than the saved baseline by more
+than the threshold and by at least 10 ms (smaller changes are noise between cold starts).
+
+Usage: python bench_startup.py [--repeat 5] [--top 25] [--save startup.json] [--compare startup.json] [--threshold 20]
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+APP_MODULE = "watt_matters_app"
+DEFERRED_MODULES = ("matplotlib.backends.backend_tkagg", "matplotlib.animation", "influxdb_client")
+
+# "import time:       536 |      15054 |   tkinter" - self and cumulative microsecs, indented by nesting level
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+# --compare only reports slowdowns of at least this many microsecs, smaller ones are noise between cold starts
+COMPARE_MIN_SLOWDOWN_US = 10000
+
+
+# One cold start: {module: (self us, cumulative us, nesting level)}
+def import_times(modules):
+    code = "; ".join("import " + module for module in modules)
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    if process.returncode != 0:
+        sys.exit("Importing {} failed: {}".format(", ".join(modules), process.stderr.strip().splitlines()[-1]))
+
+    times = {}
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            times[match.group(4)] = (int(match.group(1)), int(match.group(2)), (len(match.group(3)) - 1) // 2)
+    return times
+
+# Median self and cumulative microsecs per module of several cold starts, and the median total
+def median_times(modules, repeat):
+    runs = [import_times(modules) for _ in range(repeat)]
+    result = {}
+    for module in runs[0]:
+        samples = [run[module] for run in runs if module in run]
+        result[module] = {
+            "self_us": statistics.median(sample[0] for sample in samples),
+            "cumulative_us": statistics.median(sample[1] for sample in samples),
+        }
+    total = statistics.median(sum(times[1] for times in run.values() if times[2] == 0) for run in runs)
+    return result, total
+
+# Modules of this repository (app.py -> "app"), their import cost is what the app itself controls
+def own_modules():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return {name[:-3] for name in os.listdir(directory) if name.endswith(".py")}
+
+def regressed(before, after, threshold):
+    return after > before * (1 + threshold / 100.0) and after - before >= COMPARE_MIN_SLOWDOWN_US
+
+# The total, the imported modules and the app's own modules that got slower than the baseline
+# by more than threshold percent (and COMPARE_MIN_SLOWDOWN_US)
+def regressions(modules, total, baseline, threshold, imported):
+    found = []
+    if regressed(baseline["total_us"], total, threshold):
+        found.append(("total", baseline["total_us"], total))
+    compared = set(imported) | own_modules()
+    for module, times in modules.items():
+        before = baseline["modules"].get(module)
+        if module not in compared or before is None:
+            continue
+        if regressed(before["cumulative_us"], times["cumulative_us"], threshold):
+            found.append((module, before["cumulative_us"], times["cumulative_us"]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cold import time of the Watt Matters app per module")
+    parser.add_argument("--repeat", type=int, default=5, help="cold starts (default %(default)s)")
+    parser.add_argument("--top", type=int, default=25, help="slowest modules to print (default %(default)s)")
+    parser.add_argument("--app-only", action="store_true", help="only import the app, not the modules main() loads")
+    parser.add_argument("--save", default=None, help="write the median timings to this JSON file")
+    parser.add_argument("--compare", default=None, help="compare with timings saved by --save, exit 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=20, help="allowed slowdown in %% (default %(default)s)")
+    args = parser.parse_args()
+
+    imported = (APP_MODULE,) if args.app_only else (APP_MODULE,) + DEFERRED_MODULES
+    modules, total = median_times(imported, args.repeat)
+
+    print("Cold import of {} ({} runs, median)".format(", ".join(imported), args.repeat))
+    print("{:>10} {:>12}  {}".format("self ms", "cumulative", "module"))
+    slowest = sorted(modules.items(), key=lambda item: item[1]["cumulative_us"], reverse=True)[:args.top]
+    for module, times in slowest:
+        print("{:>10.1f} {:>12.1f}  {}".format(times["self_us"] / 1000, times["cumulative_us"] / 1000, module))
+    print("Total: {:.1f} ms".format(total / 1000))
+    for module in imported:
+        if module in modules:
+            print("  {:<36} {:>8.1f} ms".format(module, modules[module]["cumulative_us"] / 1000))
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"imported": imported, "total_us": total, "modules": modules}, file, indent=1)
+        print("Saved to {}".format(args.save))
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        found = regressions(modules, total, baseline, args.threshold, imported)
+        for module, before, after in found:
+            print("Regression: {} {:.1f} ms -> {:.1f} ms".format(module, before / 1000, after / 1000))
+        if found:
+            sys.exit(1)
+        print("No regressions over {:.0f}% compared to {}".format(args.threshold, args.compare))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Writer Check - Runs the batch writer and the disk spool against a local stand-in of the InfluxDB write endpoint
+
+The stand-in (http.server) answers POST /api/v2/write with a configurable sequence of HTTP statuses and keeps the
+records it accepted in arrival order. The check covers an outage (5xx: the batches are spooled and replayed in
+order once the endpoint answers 204 again), a wrong token (401: nothing is dropped) and rejected data
+(422: only that batch is dropped, the writer goes on and close() returns).
+
+Usage: python check_writer.py [--influxdb-client]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from influx_spool import Spool
+from influx_writer import BatchWriter
+
+ORG = "watt-matters"
+BUCKET = "electricity"
+TOKEN = "stand-in-token"
+
+# A batch with this record is answered with 422 (field type conflict) by the stand-in
+REJECTED_RECORD = "electricity electricity=\"not a number\" 0"
+
+
+# Stand-in of the InfluxDB v2 write endpoint
+class StandIn:
+
+    def __init__(self):
+        self.statuses = []      # statuses of the next requests, 204 once they are used up
+        self.accepted = []      # records of the requests answered with 204, in arrival order
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                records = [record for record in body.split("\n") if record]
+                with stand_in.lock:
+                    stand_in.requests = stand_in.requests + 1
+                    status = stand_in.statuses.pop(0) if stand_in.statuses else 204
+                    if status == 204 and REJECTED_RECORD in records:
+                        status = 422
+                    if status == 204:
+                        stand_in.accepted.extend(records)
+
+                if status == 204:
+                    self.send_response(204)
+                    self.end_headers()
+                    return
+                message = json.dumps({"code": "stand-in", "message": "status {}".format(status)}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(message)))
+                self.end_headers()
+                self.wfile.write(message)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, name="influxdb-stand-in", daemon=True).start()
+
+    def reset(self, statuses):
+        with self.lock:
+            self.statuses = list(statuses)
+            self.accepted = []
+            self.requests = 0
+
+    def close(self):
+        self.server.shutdown()
+
+
+# HTTP error of a write, carries the status like the ApiException of influxdb_client
+class WriteError(Exception):
+
+    def __init__(self, status, reason):
+        super().__init__(reason)
+        self.status = status
+
+
+# write_batch(records) that posts line protocol the way the consumer's write_api does
+def http_write_batch(url):
+    def write_batch(records):
+        request = urllib.request.Request(
+            "{}/api/v2/write?org={}&bucket={}&precision=s".format(url, ORG, BUCKET), data="\n".join(records).encode(),
+            headers={"Authorization": "Token " + TOKEN, "Content-Type": "text/plain; charset=utf-8"}, method="POST")
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except urllib.error.HTTPError as e:
+            raise WriteError(e.code, e.reason)
+    return write_batch
+
+# write_batch(records) of the consumer, with influxdb_client
+def client_write_batch(url):
+    from influxdb_client import InfluxDBClient, WritePrecision
+    from influxdb_client.client.write_api import SYNCHRONOUS
+
+    write_api = InfluxDBClient(url=url, token=TOKEN, org=ORG, timeout=5000).write_api(write_options=SYNCHRONOUS)
+    return lambda records: write_api.write(bucket=BUCKET, record=records, write_precision=WritePrecision.S)
+
+
+def records(first, count):
+    return ["electricity electricity={}i {}".format(value, 1700000000 + value) for value in range(first, first + count)]
+
+
+# One scenario: put `batches` with the stand-in answering `statuses`, expect `expected` records in this order
+def run_scenario(name, stand_in, write_batch, statuses, batches, expected, expect_rejected=0):
+    stand_in.reset(statuses)
+    directory = tempfile.mkdtemp()
+    spool = Spool(os.path.join(directory, "spool.db"))
+    writer = BatchWriter(write_batch, batch_size=10, flush_interval=0.1, report_interval=0, spool=spool,
+                         replay_batch_size=25)
+
+    for batch in batches:
+        writer.put_many(batch)
+        time.sleep(0.15)
+
+    # The writer backs off up to a few secs after a failure, give it time to replay
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and (writer.stats()["queued"] or spool.depth or len(stand_in.accepted) < len(expected)):
+        time.sleep(0.1)
+
+    started = time.monotonic()
+    writer.close(timeout=10)
+    closed = not writer.thread.is_alive()
+
+    problems = []
+    if not closed:
+        problems.append("close() didn't return within 10 sec")
+    if spool.depth:
+        problems.append("{} records left in the spool".format(spool.depth))
+    if stand_in.accepted != expected:
+        problems.append("stored {} records, expected {} in order".format(len(stand_in.accepted), len(expected)))
+    if writer.rejected != expect_rejected:
+        problems.append("{} records rejected, expected {}".format(writer.rejected, expect_rejected))
+    spool.close()
+    shutil.rmtree(directory)
+
+    print("{:<8} {}: {} requests, {} stored, {} rejected, close {:.1f} sec".format(
+        "FAIL" if problems else "PASS", name, stand_in.requests, len(stand_in.accepted), writer.rejected,
+        time.monotonic() - started))
+    for problem in problems:
+        print("         " + problem)
+    return not problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the batch writer and spool against a stand-in InfluxDB write endpoint")
+    parser.add_argument("--influxdb-client", action="store_true", help="write with influxdb_client like the consumer")
+    args = parser.parse_args()
+
+    stand_in = StandIn()
+    write_batch = client_write_batch(stand_in.url) if args.influxdb_client else http_write_batch(stand_in.url)
+
+    first, second, third = records(0, 30), records(30, 30), records(60, 30)
+    results = [
+        run_scenario("outage (503, spooled and replayed in order)", stand_in, write_batch,
+                     [503] * 3, [first, second, third], first + second + third),
+        run_scenario("wrong token (401, nothing dropped)", stand_in, write_batch,
+                     [401] * 2, [first, second], first + second),
+        run_scenario("rejected data (422, only that batch dropped)", stand_in, write_batch,
+                     [], [first, records(30, 9) + [REJECTED_RECORD], third], first + third, expect_rejected=10),
+    ]
+    stand_in.close()
+
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
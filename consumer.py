@@ -1,70 +1,245 @@
 """
-MQTT Subscriber - Listens to topic "electricity" and sends data to InfluxDB
+MQTT Subscriber - Listens to topics "electricity" and "electricity/<device>" and sends data to InfluxDB
+
+Usage: python consumer.py [--workers N] [--partition shared|hash]
 """
 
 import os
+import argparse
+import multiprocessing
+import zlib
 from dotenv import load_dotenv
-from influxdb_client import InfluxDBClient, Point
+from influxdb_client import InfluxDBClient, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
 import paho.mqtt.client as mqtt
-from datetime import date
+from datetime import date, timedelta
+import time
+import daily_totals
+import payload
+import rollups
+from influx_writer import BatchWriter, to_line_protocol
+from influx_spool import Spool
 
 load_dotenv()  # take environment variables from .env.
 
 # InfluxDB config
 BUCKET = os.getenv('INFLUXDB_BUCKET')
-client = InfluxDBClient(url=os.getenv('INFLUXDB_URL'),
-                token=os.getenv('INFLUXDB_TOKEN'), org=os.getenv('INFLUXDB_ORG'))
-write_api = client.write_api()
+
+# Batch writer config - measurements are written to InfluxDB from a background thread, never from the MQTT loop
+WRITER_BATCH_SIZE = int(os.getenv('INFLUXDB_BATCH_SIZE', 500))
+WRITER_FLUSH_INTERVAL = float(os.getenv('INFLUXDB_FLUSH_INTERVAL', 1.0))    # secs
+WRITER_MAX_QUEUE = int(os.getenv('INFLUXDB_MAX_QUEUE', 100000))
+WRITER_QUEUE_FULL_POLICY = os.getenv('INFLUXDB_QUEUE_FULL_POLICY', 'block') # block | drop_oldest | spill
+WRITER_REPORT_INTERVAL = float(os.getenv('INFLUXDB_REPORT_INTERVAL', 60))   # secs
+
+# Spool config - while InfluxDB is unreachable measurements are kept on disk and replayed on reconnect
+SPOOL_FILE = os.getenv('INFLUXDB_SPOOL_FILE', 'influxdb_spool.db')         # empty = no spool
+SPOOL_REPLAY_BATCH_SIZE = int(os.getenv('INFLUXDB_REPLAY_BATCH_SIZE', 10000))
+
+# Daily totals are summed in memory and added to the store every interval (secs)
+TOTALS_FLUSH_INTERVAL = float(os.getenv('DAILY_TOTALS_FLUSH_INTERVAL', 1.0))
+
+# Rollup tiers kept at ingest (empty = none) and how often their open windows are written (secs)
+ROLLUP_TIERS = rollups.parse_tiers(os.getenv('ROLLUP_TIERS', '1m,1h,1d'))
+ROLLUP_FLUSH_INTERVAL = float(os.getenv('ROLLUP_FLUSH_INTERVAL', 60))
 
 # MQTT broker config
 MQTT_BROKER_URL    = "mqtt.eclipseprojects.io"
 MQTT_PUBLISH_TOPIC = "electricity"
+MQTT_DEVICE_TOPICS = MQTT_PUBLISH_TOPIC + "/+"   # electricity/<device>
+MQTT_SHARED_GROUP  = os.getenv('MQTT_SHARED_GROUP', 'watt-matters-consumers')
+
+# How messages are split between worker processes
+SHARED = "shared"   # MQTT shared subscription, the broker hands every message to one worker
+HASH = "hash"       # every worker receives all messages and keeps the devices that hash to it
+
+
+# Local date of a timestamp (cached, readings of a batch are almost always on the same day)
+last_day = (None, None, None)
+def day_of(timestamp):
+    global last_day
+    day_start, day_end, day = last_day
+    if day is None or not day_start <= timestamp < day_end:
+        day = date.fromtimestamp(timestamp)
+        day_start = time.mktime(day.timetuple())
+        day_end = time.mktime((day + timedelta(days=1)).timetuple())
+        day = day.strftime("%Y-%m-%d")
+        last_day = (day_start, day_end, day)
+    return day
+
+# Device of a topic, None for the single "electricity" topic
+def device_of(topic):
+    prefix = MQTT_PUBLISH_TOPIC + "/"
+    if topic.startswith(prefix):
+        return topic[len(prefix):]
+    return None
+
+# Worker a device belongs to when partitioning by hash (crc32 is the same in every process, unlike hash())
+def partition_of(device, workers):
+    if device is None:
+        return 0
+    return zlib.crc32(device.encode()) % workers
+
+
+# One consumer process - its own MQTT client, InfluxDB batch writer, spool and daily totals
+class ConsumerWorker:
+
+    def __init__(self, index=0, workers=1, partition=SHARED, household=None, verbose=False):
+        self.index = index
+        self.workers = workers
+        self.partition = partition
+        self.verbose = verbose
+
+        # Household of readings published to the single "electricity" topic (device topics name their own)
+        self.household = household
+
+        # InfluxDB client of this worker
+        self.client = InfluxDBClient(url=os.getenv('INFLUXDB_URL'),
+                        token=os.getenv('INFLUXDB_TOKEN'), org=os.getenv('INFLUXDB_ORG'))
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        self.query_api = self.client.query_api()
+
+        # Every worker spools to its own file
+        spool_file = SPOOL_FILE
+        if spool_file and workers > 1:
+            name, extension = os.path.splitext(spool_file)
+            spool_file = "{}-{}{}".format(name, index, extension)
+        spool = Spool(spool_file) if spool_file else None
+
+        self.writer = BatchWriter(self.write_batch, batch_size=WRITER_BATCH_SIZE, flush_interval=WRITER_FLUSH_INTERVAL,
+                                  max_queue=WRITER_MAX_QUEUE, queue_full_policy=WRITER_QUEUE_FULL_POLICY,
+                                  report_interval=WRITER_REPORT_INTERVAL, spool=spool,
+                                  replay_batch_size=SPOOL_REPLAY_BATCH_SIZE)
+
+        # Daily totals store (keeps track of measurements per day even when app frontend is not running)
+        self.totals = daily_totals.DailyTotalsBuffer(daily_totals.connect(), TOTALS_FLUSH_INTERVAL)
+
+        # Rollups are written through the same batch writer. Workers of a shared subscription see different
+        # readings of the same device, so each keeps its own series (tagged with the worker) and queries combine them
+        self.rollup_worker = index if workers > 1 and partition == SHARED else None
+        self.rollups = None
+        if ROLLUP_TIERS:
+            self.rollups = rollups.RollupAggregator(self.writer.put_many, ROLLUP_TIERS, ROLLUP_FLUSH_INTERVAL,
+                                                    load=self.load_rollup, worker=self.rollup_worker)
+
+        self.mqttc = mqtt.Client()
+        self.mqttc.on_connect = self.on_connect
+        self.mqttc.on_message = self.on_message
+
+    # Points carry the sensor timestamp in seconds
+    def write_batch(self, records):
+        self.write_api.write(bucket=BUCKET, record=records, write_precision=WritePrecision.S)
+
+    # Stored rollup of a window of this worker, None if there is none (runs on the aggregator's loader thread)
+    def load_rollup(self, tier, device, start):
+        query = 'from(bucket: "' + BUCKET + '")\
+            |> range(start: ' + str(start) + ', stop: ' + str(start + 1) + ')\
+            |> filter(fn: (r) =>\
+                r._measurement == "' + rollups.measurement_of(tier) + '"\
+            )' + rollups.series_filter(device, self.rollup_worker)
+
+        fields = {}
+        try:
+            for table in self.query_api.query(org=os.getenv('INFLUXDB_ORG'), query=query):
+                for record in table.records:
+                    fields[record.get_field()] = record.get_value()
+        except Exception as e:
+            # Don't stop ingest while InfluxDB is unavailable, the window starts from zero
+            print("Worker {}: loading {} rollup at {} failed ({})".format(self.index, tier, start, e))
+            return None
+        if "count" not in fields:
+            return None
+        return fields["count"], fields["sum"], fields["sumsq"], fields["min"], fields["max"]
+
+    # Topics of this worker
+    def topics(self):
+        topics = [MQTT_PUBLISH_TOPIC, MQTT_DEVICE_TOPICS]
+        if self.workers > 1 and self.partition == SHARED:
+            return ["$share/{}/{}".format(MQTT_SHARED_GROUP, topic) for topic in topics]
+        return topics
+
+    # The callback for when the client connects to the broker.
+    def on_connect(self, client, userdata, flags, rc):
+        print("Worker {}: connected with result code {}".format(self.index, rc))
+
+        # Subscribe tο the topics
+        client.subscribe([(topic, 0) for topic in self.topics()])
+
+    # The callback for when a PUBLISH message is received from the server.
+    def on_message(self, client, userdata, msg):
+        device = device_of(msg.topic) or self.household
+        if self.workers > 1 and self.partition == HASH and partition_of(device, self.workers) != self.index:
+            return
+
+        if self.verbose:
+            print(msg.topic+" "+str(msg.payload))
+
+        # We received bytes we need to converts into something usable
+        # (one or a batch of readings, payloads without timestamp get the arrival time)
+        try:
+            readings = payload.decode(msg.payload, time.time())
+        except ValueError as e:
+            # Anyone can publish to the topics, a malformed payload must not stop the worker
+            print("Worker {}: dropped malformed payload on {} ({}): {!r}".format(self.index, msg.topic, e, msg.payload[:64]))
+            return
+
+        # Queue for InfluxDB with the time the sensor took each measurement
+        self.writer.put_many([to_line_protocol(MQTT_PUBLISH_TOPIC, timestamp, measurement, device) for timestamp, measurement in readings])
+
+        # Keep track of measurements per household and day even when app frontend is not running
+        self.totals.add(device or daily_totals.DEFAULT_HOUSEHOLD, [(day_of(timestamp), measurement) for timestamp, measurement in readings])
+
+        # Per minute, hour and day rollups
+        if self.rollups is not None:
+            self.rollups.add(device, readings)
+
+    def run(self):
+        self.mqttc.connect(MQTT_BROKER_URL)
+        try:
+            self.mqttc.loop_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Write measurements that are still queued before exiting
+            self.totals.flush()
+            if self.rollups is not None:
+                self.rollups.flush(closing=True)
+            self.writer.close()
+
+
+def run_worker(index, workers, partition, household, verbose):
+    ConsumerWorker(index, workers, partition, household, verbose).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store electricity measurements from MQTT in InfluxDB")
+    parser.add_argument("--workers", type=int, default=int(os.getenv('CONSUMER_WORKERS', 1)),
+                        help="consumer processes (default 1)")
+    parser.add_argument("--partition", choices=(SHARED, HASH), default=os.getenv('CONSUMER_PARTITION', SHARED),
+                        help="split messages between workers with an MQTT shared subscription or by device hash (default shared)")
+    parser.add_argument("--household", default=os.getenv('HOUSEHOLD_ID'),
+                        help="household id of readings on the single \"electricity\" topic (default: untagged, stored as \"default\")")
+    parser.add_argument("--verbose", action="store_true", help="print every message")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        run_worker(0, 1, args.partition, args.household, args.verbose)
+        return
+
+    # One process per worker, so ingest scales with cores instead of one callback thread
+    processes = [multiprocessing.Process(target=run_worker, args=(index, args.workers, args.partition, args.household, args.verbose),
+                                         name="consumer-{}".format(index))
+                 for index in range(args.workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Workers get the interrupt too and flush before exiting
+        for process in processes:
+            process.join()
+
 
-mqttc = mqtt.Client()
-mqttc.connect(MQTT_BROKER_URL)
-
-# The callback for when the client connects to the broker.
-def on_connect(client, userdata, flags, rc):
-    print("Connected with result code "+str(rc))
-
-    # Subscribe tο a topic
-    client.subscribe(MQTT_PUBLISH_TOPIC)
-
-# The callback for when a PUBLISH message is received from the server.
-def on_message(client, userdata, msg):
-    print(msg.topic+" "+str(msg.payload))
-
-    # We received bytes we need to converts into something usable
-    measurement = int(msg.payload)
-
-    # Write in InfluxDB
-    point = Point(MQTT_PUBLISH_TOPIC).field("electricity", measurement )
-    write_api.write(bucket=BUCKET, record=point)
-
-    # Keep track of measurements per sec even when app frontend is not running
-    with open("total-watt.csv", "r") as file:
-        last_line = file.readlines()[-1]
-        current_line = last_line.split(",")
-        watt_old_date = current_line[0]
-        watt_old_measurement = current_line[1]
-        running_hours = current_line[2]
-
-    # Check if it's new day
-    today = date.today().strftime("%Y-%m-%d")
-    if(watt_old_date != today):
-        f = open("total-watt.csv", "a")
-        f.write("\n" + str(today) + ",0,0")
-        f.close()
-    else:
-        lines = open("total-watt.csv", "r").readlines()
-        lines[-1] = today + "," + str(int(watt_old_measurement) + measurement) + "," + str(float(running_hours) + 0.000278)
-        f = open("total-watt.csv", "w")
-        f.writelines(lines)
-        f.close()
-
-
-
-# Register callbacks and start MQTT client
-mqttc.on_connect = on_connect
-mqttc.on_message = on_message
-mqttc.loop_forever()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Daily Totals Store - Keeps total electricity usage per household and day in SQLite
+"""
+
+import os
+import csv
+import sqlite3
+import time
+
+# Store config
+DATABASE_FILE = "watt_matters.db"
+LEGACY_CSV_FILE = "total-watt.csv"
+SCHEMA_VERSION = 3
+
+# Household of readings published to the single "electricity" topic (and of the data migrated from total-watt.csv)
+DEFAULT_HOUSEHOLD = "default"
+
+# Every reading stands for 1 sec of runtime (1 sec = 0.000278 hours)
+RUNTIME_PER_READING = 0.000278
+
+
+# Open the store. WAL mode lets readers (the app) and the writer (the consumer) work at the same time
+# (check_same_thread=False lets a connection move between threads that never use it at the same time)
+def connect(path=DATABASE_FILE, legacy_csv=LEGACY_CSV_FILE, check_same_thread=True):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    create_schema(conn, legacy_csv)
+    return conn
+
+# Create or upgrade the daily totals table, total-watt.csv is imported the first time the store is opened
+def create_schema(conn, legacy_csv=LEGACY_CSV_FILE):
+    # Lock the database so only one process runs the migration
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            if version < 2:
+                create_daily_totals(conn, version, legacy_csv)
+
+            # Version 3: the History page reads daily_totals directly, its old copy of the table isn't used anymore
+            conn.execute("DROP TABLE IF EXISTS total_usage")
+
+            conn.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+# Create the version 2 daily totals table, from version 1 or from total-watt.csv
+def create_daily_totals(conn, version, legacy_csv=LEGACY_CSV_FILE):
+    if version == 1:
+        # Version 1 had one series keyed by date only
+        conn.execute("ALTER TABLE daily_totals RENAME TO daily_totals_v1")
+
+    # The composite primary key is the table itself (WITHOUT ROWID), so
+    # "last N days of a household" is a single index range scan
+    conn.execute("CREATE TABLE daily_totals (\
+        household TEXT NOT NULL,\
+        dates TEXT NOT NULL,\
+        usage INTEGER NOT NULL DEFAULT 0,\
+        runtime_hours REAL NOT NULL DEFAULT 0,\
+        PRIMARY KEY (household, dates)) WITHOUT ROWID")
+
+    if version == 1:
+        conn.execute("INSERT INTO daily_totals (household, dates, usage, runtime_hours)\
+            SELECT ?, dates, usage, runtime_hours FROM daily_totals_v1", (DEFAULT_HOUSEHOLD,))
+        conn.execute("DROP TABLE daily_totals_v1")
+    else:
+        migrate_csv(conn, legacy_csv)
+
+# Copy rows of the old total-watt.csv file (dates,usage,runtime(hours)) into the store
+def migrate_csv(conn, legacy_csv=LEGACY_CSV_FILE):
+    if not legacy_csv or not os.path.exists(legacy_csv):
+        return 0
+
+    rows = []
+    with open(legacy_csv, "r") as file:
+        for row in csv.DictReader(file):
+            if not row.get("dates"):
+                continue
+            rows.append((DEFAULT_HOUSEHOLD, row["dates"], int(row["usage"]), float(row["runtime(hours)"])))
+
+    conn.executemany("INSERT OR REPLACE INTO daily_totals (household, dates, usage, runtime_hours) VALUES (?, ?, ?, ?)", rows)
+    return len(rows)
+
+# Add one reading to the total of its day - a single upsert on the primary key
+def add_reading(conn, day, measurement, household=DEFAULT_HOUSEHOLD):
+    add_readings(conn, [(day, measurement)], household)
+
+# Add many (day, measurement) readings of a household in one transaction - one upsert per day
+def add_readings(conn, readings, household=DEFAULT_HOUSEHOLD):
+    totals = {}
+    for day, measurement in readings:
+        key = (household, day)
+        usage, count = totals.get(key, (0, 0))
+        totals[key] = (usage + measurement, count + 1)
+    add_totals(conn, totals)
+
+# Add {(household, day): (usage, readings count)} to the stored totals in one transaction
+def add_totals(conn, totals):
+    conn.executemany("INSERT INTO daily_totals (household, dates, usage, runtime_hours) VALUES (?, ?, ?, ?)\
+        ON CONFLICT(household, dates) DO UPDATE SET\
+            usage = usage + excluded.usage,\
+            runtime_hours = runtime_hours + excluded.runtime_hours",
+        [(household, day, usage, count * RUNTIME_PER_READING) for (household, day), (usage, count) in totals.items()])
+    conn.commit()
+
+# Overwrite the totals of whole days, rows of (day, usage, runtime hours) - used when days are rebuilt from their data files
+def replace_days(conn, rows, household=DEFAULT_HOUSEHOLD):
+    conn.executemany("INSERT OR REPLACE INTO daily_totals (household, dates, usage, runtime_hours) VALUES (?, ?, ?, ?)",
+        [(household, day, usage, runtime_hours) for day, usage, runtime_hours in rows])
+    conn.commit()
+
+# Sums readings per (household, day) in memory and adds them to the store every flush interval,
+# so several consumer processes don't compete for the database on every message
+class DailyTotalsBuffer:
+
+    def __init__(self, conn, flush_interval=1.0):
+        self.conn = conn
+        self.flush_interval = flush_interval
+        self.totals = {}
+        self.last_flush = time.monotonic()
+
+    # Add (day, measurement) readings of a household
+    def add(self, household, readings):
+        for day, measurement in readings:
+            key = (household, day)
+            usage, count = self.totals.get(key, (0, 0))
+            self.totals[key] = (usage + measurement, count + 1)
+
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.totals:
+            return
+        add_totals(self.conn, self.totals)
+        self.totals = {}
+
+# Get (usage, runtime hours) of a day, zeros if nothing was recorded yet
+def get_day(conn, day, household=DEFAULT_HOUSEHOLD):
+    row = conn.execute("SELECT usage, runtime_hours FROM daily_totals WHERE household = ? AND dates = ?", (household, day)).fetchone()
+    if row is None:
+        return 0, 0.0
+    return row[0], row[1]
+
+# Last n days of a household (before day `before` if given) as (dates, usage, runtime hours) rows in date order -
+# reads only those n index entries, however many days are stored
+def last_days(conn, household=DEFAULT_HOUSEHOLD, n=11, before=None):
+    if before is not None:
+        rows = conn.execute("SELECT dates, usage, runtime_hours FROM daily_totals\
+            WHERE household = ? AND dates < ? ORDER BY dates DESC LIMIT ?", (household, before, n)).fetchall()
+    else:
+        rows = conn.execute("SELECT dates, usage, runtime_hours FROM daily_totals\
+            WHERE household = ? ORDER BY dates DESC LIMIT ?", (household, n)).fetchall()
+    rows.reverse()
+    return rows
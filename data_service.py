@@ -0,0 +1,103 @@
+"""
+Data Service - Runs the app's InfluxDB and SQLite queries on a thread pool, off the Tk main loop
+
+Queries are submitted under a key (e.g. "insights-week"). Their results are put on a queue that the Tk main loop
+drains with poll() from an after() callback, so widgets are only touched on the main thread. Submitting a key
+again replaces the previous request: if it hasn't started it is cancelled, if it is running its result is dropped.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DataService:
+
+    def __init__(self, client=None, workers=4, connect=None):
+        # The InfluxDB client and one query api shared by all queries (its connection pool is thread-safe).
+        # Without a client, connect() creates it when the first query uses the query api (on a worker thread)
+        self.client = client
+        self.connect = connect
+        self.connect_lock = threading.Lock()
+        self._query_api = client.query_api() if client is not None else None
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="data-service")
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.generations = {}   # key -> generation of the newest request
+        self.futures = {}       # key -> future of the newest request
+        self.latencies = {}     # key -> secs the last delivered request took from submit to result
+
+    @property
+    def query_api(self):
+        if self._query_api is None and self.connect is not None:
+            with self.connect_lock:
+                if self._query_api is None:
+                    self.client = self.connect()
+                    self._query_api = self.client.query_api()
+        return self._query_api
+
+    # Run function(*args) on the pool and call callback(result) on the thread that calls poll().
+    # errback(exception) is called instead when it raises, by default the error is printed
+    def submit(self, key, function, *args, callback=None, errback=None):
+        with self.lock:
+            generation = self.generations.get(key, 0) + 1
+            self.generations[key] = generation
+            previous = self.futures.get(key)
+            if previous is not None:
+                previous.cancel()
+            self.futures[key] = self.executor.submit(self.run, key, generation, function, args, callback, errback, time.monotonic())
+
+    # Worker thread
+    def run(self, key, generation, function, args, callback, errback, submitted):
+        try:
+            result = function(*args)
+        except Exception as e:
+            self.results.put((key, generation, errback, e, True, time.monotonic() - submitted))
+        else:
+            self.results.put((key, generation, callback, result, False, time.monotonic() - submitted))
+
+    # True while the newest request of a key hasn't been delivered yet
+    def busy(self, key):
+        with self.lock:
+            return key in self.futures
+
+    # Secs the last delivered request of a key took, 0 if none was delivered yet
+    def latency(self, key):
+        with self.lock:
+            return self.latencies.get(key, 0.0)
+
+    # Deliver finished results (call this from the Tk main loop). Results of replaced requests are dropped
+    def poll(self):
+        delivered = 0
+        while True:
+            try:
+                key, generation, callback, result, failed, latency = self.results.get_nowait()
+            except queue.Empty:
+                return delivered
+
+            with self.lock:
+                if self.generations.get(key) != generation:
+                    continue
+                del self.futures[key]
+                self.latencies[key] = latency
+
+            if failed and callback is None:
+                print("Data service: {} failed ({})".format(key, result))
+            elif callback is not None:
+                callback(result)
+            delivered = delivered + 1
+
+    # Forget the requests of a key, a result that is still on its way is dropped
+    def cancel(self, key):
+        with self.lock:
+            self.generations[key] = self.generations.get(key, 0) + 1
+            future = self.futures.pop(key, None)
+        if future is not None:
+            future.cancel()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if self.client is not None:
+            self.client.close()
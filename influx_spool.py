@@ -0,0 +1,54 @@
+"""
+InfluxDB Spool - Append-only SQLite file that keeps line protocol records while InfluxDB is unreachable
+"""
+
+import sqlite3
+import threading
+
+SPOOL_FILE = "influxdb_spool.db"
+
+
+class Spool:
+
+    def __init__(self, path=SPOOL_FILE):
+
+        # Used by the MQTT callback thread (spill) and the writer thread (spool/replay)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS spool (\
+            id INTEGER PRIMARY KEY AUTOINCREMENT,\
+            record TEXT NOT NULL)")
+        self.conn.commit()
+
+        # Records waiting to be replayed (kept in memory so the metric costs nothing)
+        self.depth = self.conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    # Append records in arrival order. They already carry their original timestamps
+    def append(self, records):
+        if not records:
+            return
+        with self.lock:
+            self.conn.executemany("INSERT INTO spool (record) VALUES (?)", ((record,) for record in records))
+            self.conn.commit()
+            self.depth = self.depth + len(records)
+
+    # Oldest records of the spool, returns the id of the last one and the records
+    def oldest(self, limit):
+        with self.lock:
+            rows = self.conn.execute("SELECT id, record FROM spool ORDER BY id LIMIT ?", (limit,)).fetchall()
+        if not rows:
+            return None, []
+        return rows[-1][0], [row[1] for row in rows]
+
+    # Remove records that were replayed successfully
+    def remove_through(self, last_id):
+        with self.lock:
+            removed = self.conn.execute("DELETE FROM spool WHERE id <= ?", (last_id,)).rowcount
+            self.conn.commit()
+            self.depth = self.depth - removed
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
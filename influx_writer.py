@@ -0,0 +1,284 @@
+"""
+InfluxDB Batch Writer - Collects measurements in a bounded queue and writes them to InfluxDB in batches from a background thread
+"""
+
+import threading
+import time
+from collections import deque
+
+# What put() does when the queue is full
+BLOCK = "block"              # wait until the writer thread makes room (backpressure to the MQTT loop)
+DROP_OLDEST = "drop_oldest"  # discard the oldest queued measurement
+SPILL = "spill"              # move the queued measurements to the disk spool
+QUEUE_FULL_POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+# Longest wait between two retries of a failed batch (secs)
+MAX_RETRY_DELAY = 30
+
+# HTTP statuses of writes InfluxDB rejected because of their data: bad line protocol, too large, field type conflict
+REJECTED_STATUSES = (400, 413, 422)
+
+
+# Line protocol of one reading with a timestamp in secs, same as
+# Point(measurement).tag("device", device).field("electricity", value).time(timestamp, WritePrecision.S)
+def to_line_protocol(measurement, timestamp, value, device=None):
+    if device:
+        return "{},device={} electricity={}i {}".format(measurement, escape_tag(device), value, timestamp)
+    return "{} electricity={}i {}".format(measurement, value, timestamp)
+
+# Escape commas, equal signs and spaces of a tag value
+def escape_tag(value):
+    return value.replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+# HTTP status of a failed write, None if it never got an answer (connection error, timeout).
+# The ApiException of influxdb_client carries it
+def status_of(e):
+    status = getattr(e, "status", None)
+    return status if isinstance(status, int) else None
+
+# Error of a failed write for the log, with its HTTP status if there is one
+def describe(e):
+    status = status_of(e)
+    return "status {}: {}".format(status, e) if status is not None else str(e)
+
+# True if InfluxDB rejected the data of a write, writing the same batch again can't succeed. Everything else
+# (connection errors, timeouts, 5xx, 429, and 401/403/404 of a wrong token, org or bucket) is worth a retry
+def is_rejected(e):
+    return status_of(e) in REJECTED_STATUSES
+
+
+class BatchWriter:
+
+    def __init__(self, write_batch, batch_size=500, flush_interval=1.0, max_queue=100000,
+                 queue_full_policy=BLOCK, report_interval=60, spool=None, replay_batch_size=10000):
+
+        if queue_full_policy not in QUEUE_FULL_POLICIES:
+            raise ValueError("Unknown queue full policy: {}".format(queue_full_policy))
+        if queue_full_policy == SPILL and spool is None:
+            raise ValueError("The spill policy needs a spool")
+
+        # write_batch(records) sends a list of line protocol records to InfluxDB
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.queue_full_policy = queue_full_policy
+        self.report_interval = report_interval
+
+        # Optional disk spool (influx_spool.Spool) - batches that can't be written are kept there and replayed later
+        self.spool = spool
+        self.replay_batch_size = replay_batch_size
+        self.database_down = False
+        self.retry_delay = 1
+        self.next_replay = 0.0
+
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closing = False
+
+        # Metrics
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.failed_writes = 0
+        self.batches = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self.replayed = 0
+        self.replay_seconds = 0.0
+        self.last_report = time.monotonic()
+        self.written_at_last_report = 0
+        self.replayed_at_last_report = 0
+        self.replay_seconds_at_last_report = 0.0
+
+        self.thread = threading.Thread(target=self.run, name="influxdb-writer", daemon=True)
+        self.thread.start()
+
+    # Queue one line protocol record (called from the MQTT callback thread)
+    def put(self, record):
+        self.put_many((record,))
+
+    # Queue many records at once (e.g. all readings of a batched MQTT payload)
+    def put_many(self, records):
+        with self.condition:
+            if self.closing:
+                raise RuntimeError("BatchWriter is closed")
+
+            for record in records:
+                while len(self.queue) >= self.max_queue:
+                    if self.queue_full_policy == DROP_OLDEST:
+                        self.queue.popleft()
+                        self.dropped = self.dropped + 1
+                    elif self.queue_full_policy == SPILL:
+                        self.spool.append(list(self.queue))
+                        self.queue.clear()
+                    else:
+                        self.condition.notify_all()
+                        self.condition.wait()
+
+                self.queue.append(record)
+
+            # Wake up the writer thread as soon as a full batch is waiting
+            if len(self.queue) >= self.batch_size:
+                self.condition.notify_all()
+
+    # Writer thread - take a batch every time it is full or the flush interval has passed
+    def run(self):
+        while True:
+            with self.condition:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self.queue) < self.batch_size and not self.closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                if not self.queue and self.closing:
+                    return
+
+                batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+
+                # Room was made in the queue
+                self.condition.notify_all()
+
+            if batch:
+                self.flush(batch)
+            if self.spool is not None and self.spool.depth and not self.closing:
+                self.replay()
+            self.report()
+
+    # Write one batch. Without a spool retry with backoff while InfluxDB is unavailable, with a spool keep it on disk
+    def flush(self, batch):
+        # Don't wait for a timeout on every batch while the database is known to be down. While spooled records are
+        # replayed, new batches queue up behind them: rollup points of a window are running totals that overwrite
+        # each other, so records have to be written in the order they were queued
+        if self.spool is not None and (self.database_down or self.spool.depth):
+            self.spool.append(batch)
+            return
+
+        retry_delay = 1
+        while True:
+            start = time.perf_counter()
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                if is_rejected(e):
+                    self.reject(batch, e)
+                    return
+                self.failed_writes = self.failed_writes + 1
+                if self.spool is not None:
+                    print("InfluxDB write of {} records failed ({}), spooling to disk".format(len(batch), describe(e)))
+                    self.spool.append(batch)
+                    self.mark_down()
+                    return
+                print("InfluxDB write of {} records failed ({}), retrying in {} sec".format(len(batch), describe(e), retry_delay))
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+                continue
+
+            elapsed = time.perf_counter() - start
+            self.written = self.written + len(batch)
+            self.batches = self.batches + 1
+            self.flush_seconds_total = self.flush_seconds_total + elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+            return
+
+    # Drop a batch InfluxDB rejected, retrying or spooling it would block the records behind it forever.
+    # InfluxDB answers a partial write with 4xx too, the valid records of the batch are stored already
+    def reject(self, records, e):
+        self.rejected = self.rejected + len(records)
+        print("InfluxDB rejected a batch of {} records ({}), dropping it. First record: {}".format(
+            len(records), describe(e), records[0]))
+
+    # Remember that InfluxDB is unreachable and when to try the spool again
+    def mark_down(self):
+        if self.database_down:
+            self.retry_delay = min(self.retry_delay * 2, MAX_RETRY_DELAY)
+        self.database_down = True
+        self.next_replay = time.monotonic() + self.retry_delay
+
+    # Catch up on spooled records in large batches, oldest first
+    def replay(self):
+        if time.monotonic() < self.next_replay:
+            return
+
+        while self.spool.depth:
+            last_id, records = self.spool.oldest(self.replay_batch_size)
+            if not records:
+                return
+
+            start = time.perf_counter()
+            try:
+                self.write_batch(records)
+            except Exception as e:
+                if is_rejected(e):
+                    self.reject(records, e)
+                    self.spool.remove_through(last_id)
+                    continue
+                self.failed_writes = self.failed_writes + 1
+                self.mark_down()
+                print("InfluxDB still unavailable ({}), {} records spooled, next try in {} sec".format(describe(e), self.spool.depth, self.retry_delay))
+                return
+
+            self.spool.remove_through(last_id)
+            self.replayed = self.replayed + len(records)
+            self.replay_seconds = self.replay_seconds + time.perf_counter() - start
+            if self.database_down:
+                print("InfluxDB is reachable again, replaying {} spooled records".format(self.spool.depth + len(records)))
+            self.database_down = False
+            self.retry_delay = 1
+
+            # Give live measurements their turn as soon as a batch of them is waiting
+            with self.condition:
+                if len(self.queue) >= self.batch_size or self.closing:
+                    return
+
+    # Current metrics of the writer
+    def stats(self):
+        with self.condition:
+            queued = len(self.queue)
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "failed_writes": self.failed_writes,
+            "batches": self.batches,
+            "queued": queued,
+            "flush_latency_avg": self.flush_seconds_total / self.batches if self.batches else 0.0,
+            "flush_latency_max": self.flush_seconds_max,
+            "spool_depth": self.spool.depth if self.spool is not None else 0,
+            "replayed": self.replayed,
+            "catch_up_rate": self.replayed / self.replay_seconds if self.replay_seconds else 0.0,
+        }
+
+    # Print throughput and flush latency every report interval
+    def report(self):
+        now = time.monotonic()
+        elapsed = now - self.last_report
+        if not self.report_interval or elapsed < self.report_interval:
+            return
+
+        stats = self.stats()
+        throughput = (stats["written"] - self.written_at_last_report) / elapsed
+        print("InfluxDB writer: {:.1f} points/sec, {} batches, flush latency avg {:.1f} ms max {:.1f} ms, queue {}/{}, dropped {}, rejected {}".format(
+            throughput, stats["batches"], stats["flush_latency_avg"] * 1000, stats["flush_latency_max"] * 1000,
+            stats["queued"], self.max_queue, stats["dropped"], stats["rejected"]))
+
+        if self.spool is not None:
+            replayed = stats["replayed"] - self.replayed_at_last_report
+            replay_seconds = self.replay_seconds - self.replay_seconds_at_last_report
+            catch_up_rate = replayed / replay_seconds if replay_seconds else 0.0
+            print("InfluxDB spool: depth {}, replayed {} records at {:.1f} records/sec".format(
+                stats["spool_depth"], replayed, catch_up_rate))
+            self.replayed_at_last_report = stats["replayed"]
+            self.replay_seconds_at_last_report = self.replay_seconds
+
+        self.last_report = now
+        self.written_at_last_report = stats["written"]
+
+    # Write everything that is still queued and stop the writer thread
+    def close(self, timeout=None):
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
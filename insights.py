@@ -0,0 +1,320 @@
+"""
+Insights - Statistics of electricity measurements (standard deviation, highest, lowest and average per time of day)
+
+Statistics are computed from per hour-of-day partial aggregates (count, sum, sum of squares, min, max).
+InfluxDB can compute the partials server-side so only 24 rows cross the wire, or they can be computed
+client-side from the raw measurements; both paths go through the same final step and give identical results.
+"""
+
+import bisect
+from collections import deque
+
+import numpy as np
+
+import rollups
+
+# Time of day buckets as (name, first hour). A bucket lasts until the next one starts,
+# the one that starts last also takes the hours before the first start (it wraps around midnight)
+TIME_OF_DAY_BUCKETS = (
+    ("night", 0),       # [00:00 - 05:00]
+    ("morning", 6),     # [06:00 - 11:00]
+    ("noon", 12),       # [12:00 - 17:00]
+    ("afternoon", 18),  # [18:00 - 23:00]
+)
+
+# Where the partial aggregates are computed
+SERVER = "server"   # in InfluxDB with Flux
+CLIENT = "client"   # in the app from the raw measurements
+INCREMENTAL = "incremental" # seeded once from InfluxDB, then kept up to date in the app reading by reading
+
+HOUR = 3600 # secs
+
+
+# Bucket index of every hour of the day (array of 24), buckets indexed in the given order
+def hour_buckets(buckets=TIME_OF_DAY_BUCKETS):
+    order = sorted(range(len(buckets)), key=lambda i: buckets[i][1])
+    starts = np.array([buckets[i][1] for i in order])
+
+    position = np.searchsorted(starts, np.arange(24), side="right") - 1
+    # Hours before the first start belong to the bucket that starts last
+    position[position < 0] = len(order) - 1
+    return np.array(order)[position]
+
+# Empty partials, a dict of arrays indexed by hour of the day
+def empty_hourly_partials():
+    return {
+        "count": np.zeros(24),
+        "sum": np.zeros(24),
+        "sumsq": np.zeros(24),
+        "min": np.full(24, np.inf),
+        "max": np.full(24, -np.inf),
+    }
+
+# Partials per hour of the day from raw values in one pass over typed arrays.
+# values: measurement values, hours: hour of the day (0-23) of each value
+def hourly_partials(values, hours):
+    values = np.asarray(values, dtype=np.float64)
+    hours = np.asarray(hours, dtype=np.intp)
+
+    partials = empty_hourly_partials()
+    partials["count"] = np.bincount(hours, minlength=24).astype(np.float64)
+    partials["sum"] = np.bincount(hours, weights=values, minlength=24)
+    partials["sumsq"] = np.bincount(hours, weights=values * values, minlength=24)
+    np.minimum.at(partials["min"], hours, values)
+    np.maximum.at(partials["max"], hours, values)
+    return partials
+
+# Measurements are integer watts, show the highest/lowest value without ".0"
+def as_measurement(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+# Final statistics from hourly partials: std, max, min and {bucket name: average}, averages of empty buckets are 0
+def statistics_from_hourly(partials, buckets=TIME_OF_DAY_BUCKETS):
+    count = partials["count"].sum()
+    if count == 0:
+        return np.nan, np.nan, np.nan, {name: 0 for name, _ in buckets}
+
+    # Sample standard deviation, like pandas
+    total = partials["sum"].sum()
+    if count > 1:
+        variance = (partials["sumsq"].sum() - total * total / count) / (count - 1)
+        std = np.sqrt(max(variance, 0.0))
+    else:
+        std = np.nan
+
+    # Combine the hours of every bucket
+    bucket = hour_buckets(buckets)
+    sums = np.bincount(bucket, weights=partials["sum"], minlength=len(buckets))
+    counts = np.bincount(bucket, weights=partials["count"], minlength=len(buckets))
+    averages = np.divide(sums, counts, out=np.zeros(len(buckets)), where=counts > 0)
+
+    return (std, as_measurement(partials["max"].max()), as_measurement(partials["min"].min()),
+            {name: averages[i] for i, (name, _) in enumerate(buckets)})
+
+# Statistics as a row of std, max, min, morning, noon, afternoon and night average
+def statistics_row(statistics):
+    std, max, min, averages = statistics
+    return std, max, min, averages["morning"], averages["noon"], averages["afternoon"], averages["night"]
+
+# Statistics of raw values (client-side path)
+def time_of_day_statistics(values, hours, buckets=TIME_OF_DAY_BUCKETS):
+    return statistics_from_hourly(hourly_partials(values, hours), buckets)
+
+
+# Flux filter for the readings of a household. Readings of the single "electricity" topic are stored
+# without device tag, readings of "electricity/<device>" topics are tagged with their device (household) id
+def household_filter(household, default_household):
+    return rollups.device_filter(None if household == default_household else household)
+
+# Raw measurements of a time range as typed arrays (values, hour of the day of each value)
+def query_range_values(query_api, org, range_start, flux_filter=""):
+    import pandas as pd
+
+    query = 'from(bucket: "electricity")\
+        |> range(start:' + range_start + ', stop: now())\
+        |> filter(fn: (r) =>\
+            r._measurement == "electricity"\
+        )' + flux_filter + '\
+        |> keep(columns: ["_time", "_value"])'
+
+    # Query InfluxDB database straight into a pandas dataframe (no FluxRecord object per row)
+    dataframe = query_api.query_data_frame(org=org, query=query)
+    if isinstance(dataframe, list):
+        dataframe = pd.concat(dataframe, ignore_index=True) if dataframe else pd.DataFrame()
+    if dataframe.empty:
+        return np.array([]), np.array([], dtype=int)
+
+    return dataframe["_value"].to_numpy(), dataframe["_time"].dt.hour.to_numpy()
+
+# Raw measurements of [start, stop) (secs since the epoch) as typed arrays (timestamps in secs, values)
+def query_values_between(query_api, org, start, stop, flux_filter=""):
+    import pandas as pd
+
+    query = 'from(bucket: "electricity")\
+        |> range(start:' + str(int(start)) + ', stop: ' + str(int(np.ceil(stop))) + ')\
+        |> filter(fn: (r) =>\
+            r._measurement == "electricity"\
+        )' + flux_filter + '\
+        |> keep(columns: ["_time", "_value"])\
+        |> sort(columns: ["_time"])'
+
+    dataframe = query_api.query_data_frame(org=org, query=query)
+    if isinstance(dataframe, list):
+        dataframe = pd.concat(dataframe, ignore_index=True) if dataframe else pd.DataFrame()
+    if dataframe.empty:
+        return np.array([]), np.array([])
+
+    # Flux ranges are in whole secs here, keep exactly [start, stop)
+    timestamps = (dataframe["_time"] - pd.Timestamp(0, tz="UTC")).dt.total_seconds().to_numpy()
+    values = dataframe["_value"].to_numpy(dtype=np.float64)
+    inside = (timestamps >= start) & (timestamps < stop)
+    return timestamps[inside], values[inside]
+
+# Statistics of raw (timestamps in secs, values), hours of the day in UTC like the other paths
+def statistics_of_readings(timestamps, values, buckets=TIME_OF_DAY_BUCKETS):
+    hours = (np.asarray(timestamps) // HOUR % 24).astype(np.intp)
+    return statistics_row(time_of_day_statistics(values, hours, buckets))
+
+# Partials per hour of the day computed by InfluxDB - at most 24 rows are returned
+def query_hourly_partials(query_api, org, range_start, flux_filter=""):
+    query = 'import "date"\n' + rollups.PARTIAL_IMPORTS + '\
+        from(bucket: "electricity")\
+        |> range(start:' + range_start + ', stop: now())\
+        |> filter(fn: (r) =>\
+            r._measurement == "electricity"\
+        )' + flux_filter + '\
+        |> map(fn: (r) => ({_time: r._time, _value: float(v: r._value), hour: date.hour(t: r._time)}))\
+        |> group(columns: ["hour"])\
+        |> reduce(\
+            identity: ' + rollups.PARTIAL_IDENTITY + ',\
+            fn: (r, accumulator) => ({\
+                count: accumulator.count + 1.0,\
+                sum: accumulator.sum + r._value,\
+                sumsq: accumulator.sumsq + r._value * r._value,\
+                min: if r._value < accumulator.min then r._value else accumulator.min,\
+                max: if r._value > accumulator.max then r._value else accumulator.max\
+            }))\
+        |> group()'
+
+    partials = empty_hourly_partials()
+    for table in query_api.query(org=org, query=query):
+        for record in table.records:
+            hour = int(record["hour"])
+            for key in partials:
+                partials[key][hour] = record[key]
+    return partials
+
+# Statistics of a time range as std, max, min, morning, noon, afternoon and night average.
+# With rollup tiers the server path reads at most one 1 hour rollup point per hour of the range
+def query_range_statistics(query_api, org, range_start, flux_filter="", aggregation=SERVER, buckets=TIME_OF_DAY_BUCKETS, tiers=()):
+    if aggregation == SERVER and tiers:
+        partials = hourly_partials_from_clock_hours(query_clock_hour_partials(query_api, org, range_start, flux_filter, tiers))
+    elif aggregation == SERVER:
+        partials = query_hourly_partials(query_api, org, range_start, flux_filter)
+    else:
+        partials = hourly_partials(*query_range_values(query_api, org, range_start, flux_filter))
+
+    return statistics_row(statistics_from_hourly(partials, buckets))
+
+# Partials per clock hour computed by InfluxDB, rows of (clock hour, count, sum, sum of squares, min, max).
+# A clock hour is the number of whole hours since the epoch, its hour of the day (UTC) is clock hour % 24.
+# With rollup tiers (see rollups.py) they are read from the 1 hour rollups instead of the raw measurements
+def query_clock_hour_partials(query_api, org, range_start, flux_filter="", tiers=()):
+    return rollups.query_window_partials(query_api, org, range_start, HOUR, flux_filter, tiers)
+
+# Partials per hour of the day from rows of per clock hour partials
+def hourly_partials_from_clock_hours(rows):
+    partials = empty_hourly_partials()
+    for hour, count, sum, sumsq, min, max in rows:
+        of_day = hour % 24
+        partials["count"][of_day] += count
+        partials["sum"][of_day] += sum
+        partials["sumsq"][of_day] += sumsq
+        partials["min"][of_day] = np.minimum(partials["min"][of_day], min)
+        partials["max"][of_day] = np.maximum(partials["max"][of_day], max)
+    return partials
+
+
+# Statistics of a rolling window of whole clock hours, kept up to date one reading at a time.
+# Every clock hour of the window has its own partials; they are also summed per hour of the day,
+# so a new reading is O(1) and an hour that slides out of the window is subtracted again.
+# The window's highest/lowest value are only recomputed from the per-hour partials when the
+# hour that held them expires.
+class SlidingWindowStatistics:
+
+    def __init__(self, window_hours, buckets=TIME_OF_DAY_BUCKETS):
+        self.window_hours = window_hours
+        self.buckets = buckets
+        self.hours = {}         # clock hour -> [count, sum, sum of squares, min, max]
+        self.order = deque()    # clock hours of the window, oldest first
+        self.newest = None
+        self.count = [0.0] * 24
+        self.sum = [0.0] * 24
+        self.sumsq = [0.0] * 24
+        self.low = np.inf
+        self.high = -np.inf
+
+    # Seed the window with rows of query_clock_hour_partials
+    def seed(self, rows):
+        for row in rows:
+            self.add_partial(*row)
+
+    # Add one reading (timestamp in secs since the epoch)
+    def add(self, timestamp, value):
+        self.add_partial(int(timestamp // HOUR), 1, value, value * value, value, value)
+
+    # Merge partials of (part of) a clock hour into the window
+    def add_partial(self, hour, count, sum, sumsq, min, max):
+        if self.newest is not None and hour <= self.newest - self.window_hours:
+            return  # already slid out of the window
+
+        partial = self.hours.get(hour)
+        if partial is None:
+            partial = [0.0, 0.0, 0.0, np.inf, -np.inf]
+            self.hours[hour] = partial
+            if not self.order or hour > self.order[-1]:
+                self.order.append(hour)
+            else:
+                # Late reading of an hour that had none yet
+                self.order.insert(bisect.bisect_left(self.order, hour), hour)
+
+        partial[0] = partial[0] + count
+        partial[1] = partial[1] + sum
+        partial[2] = partial[2] + sumsq
+        if min < partial[3]:
+            partial[3] = min
+        if max > partial[4]:
+            partial[4] = max
+
+        of_day = hour % 24
+        self.count[of_day] = self.count[of_day] + count
+        self.sum[of_day] = self.sum[of_day] + sum
+        self.sumsq[of_day] = self.sumsq[of_day] + sumsq
+        if min < self.low:
+            self.low = min
+        if max > self.high:
+            self.high = max
+
+        if self.newest is None or hour > self.newest:
+            self.newest = hour
+            self.expire(hour)
+
+    # Drop the clock hours that are no longer in a window ending at clock hour `newest`
+    def expire(self, newest):
+        extremes_expired = False
+        while self.order and self.order[0] <= newest - self.window_hours:
+            hour = self.order.popleft()
+            count, sum, sumsq, min, max = self.hours.pop(hour)
+            of_day = hour % 24
+            self.count[of_day] = self.count[of_day] - count
+            self.sum[of_day] = self.sum[of_day] - sum
+            self.sumsq[of_day] = self.sumsq[of_day] - sumsq
+            if min <= self.low or max >= self.high:
+                extremes_expired = True
+
+        if extremes_expired:
+            self.low = np.inf
+            self.high = -np.inf
+            for count, sum, sumsq, min, max in self.hours.values():
+                if min < self.low:
+                    self.low = min
+                if max > self.high:
+                    self.high = max
+
+    # Statistics of the window ending at `now` (secs since the epoch), as std, max, min, morning, noon, afternoon and night average
+    def statistics(self, now):
+        hour = int(now // HOUR)
+        if self.newest is None or hour > self.newest:
+            self.newest = hour
+            self.expire(hour)
+
+        # The window only keeps its overall extremes, which is all statistics_from_hourly reads of min/max
+        partials = {
+            "count": np.array(self.count),
+            "sum": np.array(self.sum),
+            "sumsq": np.array(self.sumsq),
+            "min": np.array([self.low]),
+            "max": np.array([self.high]),
+        }
+        return statistics_row(statistics_from_hourly(partials, self.buckets))
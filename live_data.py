@@ -0,0 +1,59 @@
+"""
+Live Data - Fixed-capacity ring buffer of (timestamp, value) readings for the live chart
+"""
+
+import numpy as np
+
+
+# Keeps the newest `capacity` readings in preallocated NumPy arrays, so memory stays the same however long the
+# app runs. Every reading is stored twice (at i and i + capacity), which keeps the buffered readings one
+# contiguous slice in time order: view() returns that slice without copying
+class RingBuffer:
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("A ring buffer holds at least 1 reading")
+        self.capacity = capacity
+        self.timestamps = np.full(2 * capacity, np.nan)
+        self.values = np.full(2 * capacity, np.nan)
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    # Add one reading (timestamp in secs since the epoch), the oldest one is dropped when the buffer is full
+    def append(self, timestamp, value):
+        position = (self.start + self.size) % self.capacity
+        self.timestamps[position] = self.timestamps[position + self.capacity] = timestamp
+        self.values[position] = self.values[position + self.capacity] = value
+        if self.size < self.capacity:
+            self.size = self.size + 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    # Add many readings in time order
+    def extend(self, timestamps, values):
+        timestamps = np.asarray(timestamps, dtype=np.float64)[-self.capacity:]
+        values = np.asarray(values, dtype=np.float64)[-self.capacity:]
+        for timestamp, value in zip(timestamps, values):
+            self.append(timestamp, value)
+
+    # Buffered (timestamps, values) in time order - read-only views, valid until the next append
+    def view(self):
+        timestamps = self.timestamps[self.start:self.start + self.size]
+        values = self.values[self.start:self.start + self.size]
+        timestamps.flags.writeable = False
+        values.flags.writeable = False
+        return timestamps, values
+
+    # Newest (timestamp, value), None if the buffer is empty
+    def last(self):
+        if not self.size:
+            return None
+        position = (self.start + self.size - 1) % self.capacity
+        return self.timestamps[position], self.values[position]
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
@@ -0,0 +1,215 @@
+"""
+MQTT Load Generator - Simulates many smart sensors on one asyncio event loop
+
+Every virtual sensor is its own MQTT client that publishes to "electricity/<device>" from its own watt_data
+file, with a phase offset, so the consumer and the app can be load-tested with many meters at once.
+
+Usage: python load_generator.py --devices 500 [--rate 1] [--qos 1] [--inflight 10] [--duration 60]
+"""
+
+import argparse
+import asyncio
+import time
+from array import array
+
+import paho.mqtt.client as mqtt
+import payload
+import watt_data
+from smart_sensor import MQTT_PUBLISH_TOPIC
+
+# A public broker must not be load-tested, run one locally (e.g. mosquitto)
+DEFAULT_BROKER_URL = "localhost"
+
+
+# Drive a paho client from the asyncio event loop instead of its own network thread
+class AsyncioHelper:
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.misc = None
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        if self.misc is not None:
+            self.misc.cancel()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    # Keepalive pings and retries
+    async def misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
+
+class VirtualSensor:
+
+    def __init__(self, device, values, offset, stats, args):
+        self.device = device
+        self.topic = "{}/{}".format(MQTT_PUBLISH_TOPIC, device)
+        self.values = values
+        self.position = offset
+        self.timestamp = None   # of the next reading (secs)
+        self.stats = stats
+        self.args = args
+
+        # In-flight window - a publish waits while `inflight` messages of this sensor are not acknowledged yet
+        self.window = asyncio.Semaphore(args.inflight)
+
+        self.client = mqtt.Client(client_id="watt-load-{}".format(device))
+        self.client.max_inflight_messages_set(args.inflight)
+        self.client.on_publish = self.on_publish
+        self.helper = AsyncioHelper(asyncio.get_running_loop(), self.client)
+
+    # Called from the event loop when the broker acknowledged a message (QoS 0: when it was written to the socket)
+    def on_publish(self, client, userdata, mid):
+        self.stats["acknowledged"] = self.stats["acknowledged"] + 1
+        self.window.release()
+
+    # Next (timestamp, value) reading. Every reading is one second after the previous one, so all readings of a
+    # sensor are distinct points (with more than one reading per sec they run ahead of the clock)
+    def next_reading(self):
+        value = self.values[self.position % len(self.values)]
+        self.position = self.position + 1
+        reading = (self.timestamp, value)
+        self.timestamp = self.timestamp + 1
+        return reading
+
+    # Publish at `rate` messages per sec until stopped, paced against the start time so there is no drift
+    async def run(self, start, stop):
+        interval = 1 / self.args.rate
+        messages = 0
+        self.timestamp = int(time.time())
+        while True:
+            due = start + messages * interval
+            if due >= stop:
+                return
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            await self.window.acquire()
+            if self.args.batch_size > 1:
+                message = payload.encode_batch([self.next_reading() for _ in range(self.args.batch_size)])
+            else:
+                message = payload.encode_reading(*self.next_reading())
+
+            info = self.client.publish(self.topic, message, qos=self.args.qos)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.stats["published"] = self.stats["published"] + 1
+            else:
+                # Not sent (e.g. connection lost) - on_publish won't come, free the slot
+                self.stats["errors"] = self.stats["errors"] + 1
+                self.window.release()
+            messages = messages + 1
+
+            # Behind schedule - let other sensors run before catching up
+            if delay <= 0:
+                await asyncio.sleep(0)
+
+
+# Values of the day files used by the sensors, as int arrays (4 bytes per reading)
+def load_values(args):
+    values = []
+    for day in watt_data.days(args.start, args.end):
+        try:
+            values.append(array("i", (int(value) for value in watt_data.read_day(day, args.data_directory))))
+        except FileNotFoundError:
+            continue
+        if len(values) >= args.devices:
+            break
+    if not values:
+        raise SystemExit("No watt_data files found in {}".format(args.data_directory))
+    return values
+
+
+# Print achieved vs target messages per sec
+async def report(stats, target_rate, interval):
+    last = time.monotonic()
+    published_at_last = 0
+    acknowledged_at_last = 0
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        elapsed = now - last
+        published = stats["published"]
+        acknowledged = stats["acknowledged"]
+        print("published {:.1f} msg/sec, acknowledged {:.1f} msg/sec, target {:.1f} msg/sec, in flight {}, errors {}".format(
+            (published - published_at_last) / elapsed, (acknowledged - acknowledged_at_last) / elapsed,
+            target_rate, published - acknowledged, stats["errors"]))
+        last = now
+        published_at_last = published
+        acknowledged_at_last = acknowledged
+
+
+async def run(args):
+    values = load_values(args)
+    stats = {"published": 0, "acknowledged": 0, "errors": 0}
+
+    # Every sensor gets its own day file and a phase offset within it
+    sensors = []
+    for i in range(args.devices):
+        device = "{}{}".format(args.device_prefix, i)
+        day_values = values[i % len(values)]
+        sensors.append(VirtualSensor(device, day_values, (i * 7919) % len(day_values), stats, args))
+
+    for sensor in sensors:
+        sensor.client.connect(args.broker, args.port)
+    print("Connected {} virtual sensors to {}".format(len(sensors), args.broker))
+
+    target_rate = args.devices * args.rate
+    reporter = asyncio.get_running_loop().create_task(report(stats, target_rate, args.report_interval))
+
+    start = time.monotonic()
+    stop = start + args.duration if args.duration else float("inf")
+    try:
+        await asyncio.gather(*(sensor.run(start, stop) for sensor in sensors))
+    finally:
+        elapsed = time.monotonic() - start
+        reporter.cancel()
+        for sensor in sensors:
+            sensor.client.disconnect()
+        print("Published {} messages in {:.1f} sec: {:.1f} msg/sec achieved, {:.1f} msg/sec target".format(
+            stats["published"], elapsed, stats["published"] / elapsed if elapsed else 0, target_rate))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many smart sensors publishing to the MQTT broker")
+    parser.add_argument("--devices", type=int, default=100, help="virtual sensors (default %(default)s)")
+    parser.add_argument("--rate", type=float, default=1, help="messages per sec per sensor (default %(default)s)")
+    parser.add_argument("--qos", type=int, choices=(0, 1, 2), default=0, help="MQTT QoS (default %(default)s)")
+    parser.add_argument("--inflight", type=int, default=10, help="unacknowledged messages per sensor (default %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=1, help="readings per message, one second apart (default %(default)s)")
+    parser.add_argument("--duration", type=float, default=60, help="secs to run, 0 = until stopped (default %(default)s)")
+    parser.add_argument("--broker", default=DEFAULT_BROKER_URL, help="MQTT broker host (default %(default)s)")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port (default %(default)s)")
+    parser.add_argument("--device-prefix", default="meter-", help="device id prefix (default %(default)s)")
+    parser.add_argument("--start", default=watt_data.FIRST_DAY, help="first day file to use (default %(default)s)")
+    parser.add_argument("--end", default=watt_data.LAST_DAY, help="last day file to use (default %(default)s)")
+    parser.add_argument("--data-directory", default=watt_data.WATT_DATA_DIRECTORY, help="directory of the day files")
+    parser.add_argument("--report-interval", type=float, default=5, help="secs between reports (default %(default)s)")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
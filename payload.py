@@ -0,0 +1,74 @@
+"""
+MQTT Payload - How the smart sensor encodes electricity measurements and how the consumer decodes them
+"""
+
+import struct
+import sys
+from array import array
+from itertools import accumulate
+
+# Formats:
+#   b"<watt>"                    legacy, bare value without timestamp (the consumer uses the arrival time)
+#   b"<unix time secs>,<watt>"   value with the time the sensor took it, e.g. b"1684490400,523"
+#   batch (binary, little endian):
+#       header  "WMB" | version (uint8) | count N (uint16) | first timestamp (uint32 secs)
+#       N-1 timestamp deltas (uint16 secs, delta-encoded against the previous reading)
+#       N values (int32 watt)
+BATCH_MAGIC = b"WMB"
+BATCH_VERSION = 1
+BATCH_HEADER = struct.Struct("<3sBHI")
+MAX_BATCH_READINGS = 0xFFFF
+
+
+# Encode one measurement with its sensor timestamp (unix time in secs)
+def encode_reading(timestamp, value):
+    return "{},{}".format(int(timestamp), int(value)).encode()
+
+# Encode many (timestamp, watt) readings in one binary payload. Readings must be in time order, less than 18 hours apart
+def encode_batch(readings):
+    if not readings or len(readings) > MAX_BATCH_READINGS:
+        raise ValueError("A batch holds 1 to {} readings".format(MAX_BATCH_READINGS))
+
+    timestamps = [int(timestamp) for timestamp, _ in readings]
+    deltas = array("H", [timestamps[i] - timestamps[i - 1] for i in range(1, len(timestamps))])
+    values = array("i", [int(value) for _, value in readings])
+    if sys.byteorder == "big":
+        deltas.byteswap()
+        values.byteswap()
+
+    return BATCH_HEADER.pack(BATCH_MAGIC, BATCH_VERSION, len(readings), timestamps[0]) + deltas.tobytes() + values.tobytes()
+
+# Decode a binary batch with array/accumulate (no per-reading parsing in Python)
+def decode_batch(payload):
+    if len(payload) < BATCH_HEADER.size:
+        raise ValueError("Truncated batch payload")
+    magic, version, count, first_timestamp = BATCH_HEADER.unpack_from(payload)
+    if magic != BATCH_MAGIC or version != BATCH_VERSION:
+        raise ValueError("Unknown batch payload")
+
+    deltas_end = BATCH_HEADER.size + (count - 1) * 2
+    deltas = array("H")
+    deltas.frombytes(payload[BATCH_HEADER.size:deltas_end])
+    values = array("i")
+    values.frombytes(payload[deltas_end:deltas_end + count * 4])
+    if sys.byteorder == "big":
+        deltas.byteswap()
+        values.byteswap()
+
+    if len(values) != count:
+        raise ValueError("Truncated batch payload")
+
+    timestamps = accumulate(deltas, initial=first_timestamp)
+    return list(zip(timestamps, values))
+
+# Decode a payload to a list of (timestamp secs, watt) readings, raises ValueError if it is malformed
+def decode(payload, arrival_time):
+    if payload.startswith(BATCH_MAGIC):
+        return decode_batch(payload)
+
+    if b"," in payload:
+        timestamp, value = payload.split(b",", 1)
+        return [(int(timestamp), int(value))]
+
+    # Legacy payload
+    return [(int(arrival_time), int(payload))]
@@ -0,0 +1,128 @@
+"""
+Query Cache - Keeps readings already fetched from InfluxDB in memory and serves overlapping time ranges from them
+
+The Insights week (168h) range is part of the month (730h) range and both are refreshed every 20 secs. The cache
+fetches the month once, afterwards only the readings since the last refresh, and serves the week from memory.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+class RangeCache:
+
+    def __init__(self, fetch, horizon, fresh_for=5, settle=5, max_age=3600, max_points=5000000, report_interval=300, name="cache"):
+        # fetch(start, stop) returns the (timestamps, values) arrays of the readings in [start, stop), timestamps in secs
+        self.fetch = fetch
+        # Readings older than `horizon` secs before the newest request are evicted
+        self.horizon = horizon
+        # Requests within `fresh_for` secs of the last fetch are served from memory without fetching the new edge
+        self.fresh_for = fresh_for
+        # The newest `settle` secs are fetched again next time, readings may still be on their way to InfluxDB
+        self.settle = settle
+        # The whole cache is fetched again after `max_age` secs, so readings that were written late show up too
+        self.max_age = max_age
+        # At most this many readings are kept, the oldest are evicted first
+        self.max_points = max_points
+        self.report_interval = report_interval
+        self.name = name
+
+        self.lock = threading.Lock()
+        self.clear()
+
+        # Metrics
+        self.hits = 0           # served from memory
+        self.partial_hits = 0   # only the uncovered edge(s) were fetched
+        self.misses = 0         # the whole range was fetched
+        self.fetched_points = 0
+        self.last_report = time.monotonic()
+
+    def clear(self):
+        self.timestamps = np.array([])
+        self.values = np.array([])
+        self.covered_start = None   # all readings in [covered_start, covered_stop) are cached
+        self.covered_stop = None
+        self.created = None
+        self.last_fetch = None
+
+    # Readings in [start, stop) as (timestamps, values) arrays, stop is usually now. Callers on other threads wait
+    # while a fetch is running and are then served from memory, so overlapping ranges are only fetched once
+    def get(self, start, stop):
+        with self.lock:
+            now = time.monotonic()
+            if self.created is not None and now - self.created > self.max_age:
+                self.clear()
+
+            if self.covered_start is None or start >= self.covered_stop or stop <= self.covered_start:
+                self.misses = self.misses + 1
+                self.clear()
+                self.add(start, stop, self.fetch(start, stop))
+                self.created = now
+            elif start >= self.covered_start and (stop <= self.covered_stop or now - self.last_fetch < self.fresh_for):
+                self.hits = self.hits + 1
+            else:
+                self.partial_hits = self.partial_hits + 1
+                if start < self.covered_start:
+                    self.add(start, self.covered_start, self.fetch(start, self.covered_start))
+                if stop > self.covered_stop:
+                    self.add(self.covered_stop, stop, self.fetch(self.covered_stop, stop))
+
+            self.evict(stop)
+            self.report()
+
+            first, last = np.searchsorted(self.timestamps, (start, stop), side="left")
+            return self.timestamps[first:last], self.values[first:last]
+
+    # Merge the fetched readings of [start, stop) - the range is right before or after the covered range
+    def add(self, start, stop, readings):
+        timestamps, values = (np.asarray(array, dtype=np.float64) for array in readings)
+        self.fetched_points = self.fetched_points + len(timestamps)
+        self.last_fetch = time.monotonic()
+
+        if self.covered_start is None:
+            self.timestamps, self.values = timestamps, values
+            self.covered_start, self.covered_stop = start, stop
+        elif start < self.covered_start:
+            self.timestamps = np.concatenate((timestamps, self.timestamps))
+            self.values = np.concatenate((values, self.values))
+            self.covered_start = start
+        else:
+            # Readings of the unsettled end are in the fetched ones again
+            keep = np.searchsorted(self.timestamps, start, side="left")
+            self.timestamps = np.concatenate((self.timestamps[:keep], timestamps))
+            self.values = np.concatenate((self.values[:keep], values))
+            self.covered_stop = stop
+
+        self.covered_stop = min(self.covered_stop, time.time() - self.settle)
+
+    # Drop readings that are older than the horizon or over the size limit
+    def evict(self, newest):
+        self.covered_start = max(self.covered_start, newest - self.horizon)
+        first = np.searchsorted(self.timestamps, self.covered_start, side="left")
+        if len(self.timestamps) - first > self.max_points:
+            first = len(self.timestamps) - self.max_points
+            self.covered_start = np.nextafter(self.timestamps[first - 1], np.inf)
+        if first > 0:
+            self.timestamps = self.timestamps[first:]
+            self.values = self.values[first:]
+
+    # Print hit/miss counters every report interval
+    def report(self):
+        now = time.monotonic()
+        if not self.report_interval or now - self.last_report < self.report_interval:
+            return
+        stats = self.stats()
+        print("Query cache {}: {} hits, {} partial hits, {} misses, {} points fetched, {} cached".format(
+            self.name, stats["hits"], stats["partial_hits"], stats["misses"], stats["fetched_points"], stats["cached_points"]))
+        self.last_report = now
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "partial_hits": self.partial_hits,
+            "misses": self.misses,
+            "fetched_points": self.fetched_points,
+            "cached_points": len(self.timestamps),
+        }
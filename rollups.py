@@ -0,0 +1,283 @@
+"""
+Rollups - Downsampled series of the electricity measurements per 1 minute, 1 hour and 1 day
+
+Every rollup point holds count, sum, sum of squares, min and max of the readings of its window, so any
+coarser window (and mean, standard deviation, highest and lowest value) can be computed from the rollups
+of a finer tier without reading the raw 1 Hz measurements. Windows are aligned to the epoch (UTC).
+"""
+
+import queue
+import threading
+import time
+
+from influx_writer import escape_tag
+
+# Measurement of the raw readings
+MEASUREMENT = "electricity"
+
+# Rollup tiers as (name, window secs), finest first. Tier "1m" is stored in measurement "electricity_1m" etc.
+TIERS = (("1m", 60), ("1h", 3600), ("1d", 86400))
+
+# Tier name of the raw measurements in tier_for()
+RAW = "raw"
+
+# Identity of a Flux reduce() into a partial (count, sum, sum of squares, min, max). Flux float literals have no
+# exponent, so min and max start at math.maxfloat: queries that use it start with PARTIAL_IMPORTS
+PARTIAL_IMPORTS = 'import "math"\n'
+PARTIAL_IDENTITY = '{count: 0.0, sum: 0.0, sumsq: 0.0, min: math.maxfloat, max: -math.maxfloat}'
+
+
+def measurement_of(tier):
+    return "{}_{}".format(MEASUREMENT, tier)
+
+# Tiers (a subset of TIERS) from a comma separated list of names, e.g. "1m,1h,1d"
+def parse_tiers(names):
+    names = [name.strip() for name in names.split(",") if name.strip()]
+    unknown = [name for name in names if name not in dict(TIERS)]
+    if unknown:
+        raise ValueError("Unknown rollup tier(s): {}".format(", ".join(unknown)))
+    return tuple((name, size) for name, size in TIERS if name in names)
+
+# Line protocol of one rollup point, timestamp is the start of its window in secs
+def to_line_protocol(tier, start, partial, device=None, worker=None):
+    count, sum, sumsq, min, max = partial
+    tags = ""
+    if device:
+        tags = tags + ",device=" + escape_tag(device)
+    if worker is not None:
+        tags = tags + ",worker=" + escape_tag(str(worker))
+    return "{}{} count={}i,sum={},sumsq={},min={},max={} {}".format(
+        measurement_of(tier), tags, int(count), float(sum), float(sumsq), float(min), float(max), int(start))
+
+# Flux string literal of a tag value
+def flux_string(value):
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+# Flux filter of the series of one device, None = readings of the single "electricity" topic (stored without device tag)
+def device_filter(device):
+    if not device:
+        return '|> filter(fn: (r) => not exists r.device)'
+    return '|> filter(fn: (r) => r.device == ' + flux_string(device) + ')'
+
+# Flux filter of the series of one device and worker
+def series_filter(device=None, worker=None):
+    flux_filter = device_filter(device)
+    if worker is not None:
+        flux_filter = flux_filter + '|> filter(fn: (r) => r.worker == ' + flux_string(worker) + ')'
+    return flux_filter
+
+
+# Add the partial (count, sum, sum of squares, min, max) of some readings to a window and mark it changed
+def merge_partial(window, count, sum, sumsq, min, max):
+    window[0] = window[0] + count
+    window[1] = window[1] + sum
+    window[2] = window[2] + sumsq
+    if min < window[3]:
+        window[3] = min
+    if max > window[4]:
+        window[4] = max
+    window[5] = True
+
+
+# Keeps the open windows of every tier per device in memory and emits them as rollup points.
+# A window is emitted every flush interval while it gets readings and a last time once it is closed
+# (its end plus the grace period is older than the newest reading of its device). A point of the same
+# window overwrites the previous one, so emitted points are always the running totals of the window.
+class RollupAggregator:
+
+    def __init__(self, emit, tiers=TIERS, flush_interval=60.0, grace=10, load=None, worker=None, load_timeout=30, max_loads=1000):
+        # emit(records) queues line protocol records for InfluxDB
+        self.emit = emit
+        self.tiers = tiers
+        self.flush_interval = flush_interval
+        self.grace = grace
+        self.worker = worker
+
+        # load(tier, device, start) returns the stored (count, sum, sum of squares, min, max) of a window or None.
+        # A window that may already be stored (it was open when this aggregator started or was emitted and dropped
+        # already) is merged with it, so a restart or a late reading doesn't overwrite it with a partial total.
+        # Windows that ended before the start aren't loaded: replays of old readings (smart_sensor --speed) would
+        # otherwise query every window they touch.
+        # Loads are queries, they run on a loader thread so add() never waits for InfluxDB: the window collects
+        # readings meanwhile and isn't emitted until the stored values were merged into it. At most `max_loads`
+        # wait, windows beyond that are emitted with the readings of this aggregator only
+        self.load = load
+        self.load_timeout = load_timeout
+        self.started = time.time()
+        self.dropped_through = {}   # (tier, device) -> start of the newest window dropped from memory
+        self.load_requests = queue.Queue(maxsize=max_loads)
+        self.skipped_loads = 0
+        self.loaded = queue.Queue()     # (key, stored partial or None) from the loader thread
+        self.loader = None
+
+        # (tier, device, start) -> [count, sum, sum of squares, min, max, changed since emitted, waiting for load]
+        self.windows = {}
+        self.newest = {}    # device -> newest reading timestamp
+        self.last_flush = time.monotonic()
+
+    # Add (timestamp, value) readings of a device
+    def add(self, device, readings):
+        for timestamp, value in readings:
+            self.add_partial(device, timestamp, 1, value, value * value, value, value)
+
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    # Add partials of readings that all fall in the same window of every tier (e.g. one minute of readings)
+    def add_partial(self, device, timestamp, count, sum, sumsq, min, max):
+        for tier, size in self.tiers:
+            start = int(timestamp // size) * size
+            key = (tier, device, start)
+            window = self.windows.get(key)
+            if window is None:
+                window = self.open_window(tier, device, start)
+            merge_partial(window, count, sum, sumsq, min, max)
+
+        if timestamp > self.newest.get(device, timestamp - 1):
+            self.newest[device] = timestamp
+
+    def open_window(self, tier, device, start):
+        window = [0, 0.0, 0.0, float("inf"), float("-inf"), False, False]
+        key = (tier, device, start)
+        if self.load is not None and self.may_be_stored(tier, device, start):
+            if self.loader is None:
+                self.loader = threading.Thread(target=self.run_loader, name="rollup-loader", daemon=True)
+                self.loader.start()
+            try:
+                self.load_requests.put_nowait(key)
+                window[6] = True
+            except queue.Full:
+                self.skipped_loads = self.skipped_loads + 1
+        self.windows[key] = window
+        return window
+
+    # True if a window was open when this aggregator started, or a window of it was dropped from memory already
+    def may_be_stored(self, tier, device, start):
+        size = dict(self.tiers)[tier]
+        if start <= self.started < start + size:
+            return True
+        return start <= self.dropped_through.get((tier, device), start - 1)
+
+    # Loader thread
+    def run_loader(self):
+        while True:
+            key = self.load_requests.get()
+            if key is None:
+                return
+            try:
+                stored = self.load(*key)
+            except Exception as e:
+                print("Loading rollup {} failed ({})".format(key, e))
+                stored = None
+            self.loaded.put((key, stored))
+
+    # Merge the stored values that were loaded since the last call into their windows
+    def merge_loaded(self):
+        while True:
+            try:
+                key, stored = self.loaded.get_nowait()
+            except queue.Empty:
+                return
+            window = self.windows.get(key)
+            if window is None:
+                continue
+            if stored is not None:
+                merge_partial(window, *stored)
+            window[6] = False
+
+    # Wait for the loads that are still running (at most load_timeout secs), windows whose load didn't
+    # finish are emitted with the readings of this aggregator only
+    def finish_loading(self):
+        if self.loader is not None:
+            self.load_requests.put(None)
+            self.loader.join(self.load_timeout)
+            self.loader = None
+        self.merge_loaded()
+
+    # Emit the windows that changed, and drop closed windows from memory (all of them when closing).
+    # Windows that are still waiting for their stored values are kept back
+    def flush(self, closing=False):
+        self.last_flush = time.monotonic()
+        if closing:
+            self.finish_loading()
+        else:
+            self.merge_loaded()
+
+        sizes = dict(self.tiers)
+        records = []
+        for key in list(self.windows):
+            tier, device, start = key
+            window = self.windows[key]
+            if window[6] and not closing:
+                continue
+            if window[5]:
+                records.append(to_line_protocol(tier, start, window[:5], device, self.worker))
+                window[5] = False
+
+            if closing or start + sizes[tier] + self.grace <= self.newest.get(device, 0):
+                del self.windows[key]
+                if start > self.dropped_through.get((tier, device), start - 1):
+                    self.dropped_through[(tier, device)] = start
+
+        if self.skipped_loads:
+            print("Rollups: {} windows emitted without their stored values, too many loads were waiting".format(self.skipped_loads))
+            self.skipped_loads = 0
+
+        if records:
+            self.emit(records)
+        return len(records)
+
+
+# Coarsest tier whose windows fit `every` secs exactly, RAW if no tier does
+def tier_for(every, tiers=TIERS):
+    for tier, size in reversed(tiers):
+        if every >= size and every % size == 0:
+            return tier
+    return RAW
+
+# Partials per window of `every` secs, rows of (window index, count, sum, sum of squares, min, max) where the
+# window starts at window index * every. They are read from the coarsest rollup tier that can answer the query
+# (at most `every` / tier size rollup points per window) or from the raw measurements when no tier can.
+# Rollup windows are never split, a range that doesn't start on a tier window includes the whole first window
+def query_window_partials(query_api, org, range_start, every, flux_filter="", tiers=TIERS):
+    tier = tier_for(every, tiers)
+    every_ns = str(int(every) * 1000000000)
+
+    if tier == RAW:
+        query = PARTIAL_IMPORTS + 'from(bucket: "electricity")\
+            |> range(start:' + range_start + ', stop: now())\
+            |> filter(fn: (r) =>\
+                r._measurement == "' + MEASUREMENT + '"\
+            )' + flux_filter + '\
+            |> map(fn: (r) => ({_time: r._time, window: int(v: r._time) / ' + every_ns + ',\
+                count: 1.0, sum: float(v: r._value), sumsq: float(v: r._value) * float(v: r._value),\
+                min: float(v: r._value), max: float(v: r._value)}))'
+    else:
+        # Points of the tier are pivoted into rows of all fields; series of several consumer workers are combined too
+        query = PARTIAL_IMPORTS + 'from(bucket: "electricity")\
+            |> range(start:' + range_start + ', stop: now())\
+            |> filter(fn: (r) =>\
+                r._measurement == "' + measurement_of(tier) + '"\
+            )' + flux_filter + '\
+            |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\
+            |> map(fn: (r) => ({_time: r._time, window: int(v: r._time) / ' + every_ns + ',\
+                count: float(v: r.count), sum: r.sum, sumsq: r.sumsq, min: r.min, max: r.max}))'
+
+    query = query + '\
+        |> group(columns: ["window"])\
+        |> reduce(\
+            identity: ' + PARTIAL_IDENTITY + ',\
+            fn: (r, accumulator) => ({\
+                count: accumulator.count + r.count,\
+                sum: accumulator.sum + r.sum,\
+                sumsq: accumulator.sumsq + r.sumsq,\
+                min: if r.min < accumulator.min then r.min else accumulator.min,\
+                max: if r.max > accumulator.max then r.max else accumulator.max\
+            }))\
+        |> group()'
+
+    rows = []
+    for table in query_api.query(org=org, query=query):
+        for record in table.records:
+            rows.append((int(record["window"]), record["count"], record["sum"], record["sumsq"], record["min"], record["max"]))
+    return rows
@@ -0,0 +1,164 @@
+"""
+Scheduler - Runs all periodic work of the app from one timer on the Tk main loop
+
+Every task has an interval and optionally the page it belongs to: tasks of a hidden page are paused and
+run as soon as their page is shown again if they are due. Tasks that are due within the same tick run
+together, a task that fell behind runs once instead of catching up, and a tick is skipped while the
+previous run of the task is still in flight (its query hasn't returned yet). The interval of a task
+grows with the observed latency of its queries, so a slow InfluxDB is queried less often.
+"""
+
+import time
+
+
+class Task:
+
+    def __init__(self, name, function, interval, page=None, busy=None, latency=None, max_interval=None):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        # Page (frame class) the task belongs to, None = runs whatever page is shown
+        self.page = page
+        # busy() is True while the previous run is still in flight
+        self.busy = busy
+        # latency() returns the secs the last run took to deliver its result
+        self.latency = latency
+        self.max_interval = max_interval if max_interval is not None else interval * 10
+
+        self.next_due = 0.0   # due at once
+        self.runs = 0
+        self.skipped = 0
+
+
+class Scheduler:
+
+    def __init__(self, coalesce=0.05, latency_factor=3, report_interval=300):
+        # Tasks due within `coalesce` secs of a tick run in that tick
+        self.coalesce = coalesce
+        # A task runs at most every `latency_factor` times its observed latency (up to its max interval)
+        self.latency_factor = latency_factor
+        self.report_interval = report_interval
+
+        self.tasks = []
+        self.visible = None
+        self.after = None
+        self.after_cancel = None
+        self.timer = None
+        self.last_report = time.monotonic()
+
+    def add(self, name, function, interval, page=None, busy=None, latency=None, max_interval=None):
+        task = Task(name, function, interval, page, busy, latency, max_interval)
+        self.tasks.append(task)
+        self.wake()
+        return task
+
+    # Start ticking - after(ms, callback) and after_cancel(id) of the Tk main loop
+    def start(self, after, after_cancel):
+        self.after = after
+        self.after_cancel = after_cancel
+        self.schedule()
+
+    def stop(self):
+        if self.timer is not None:
+            self.after_cancel(self.timer)
+        self.timer = None
+        self.after = None
+
+    # The page that is shown now, its due tasks run at the next tick
+    def show(self, page):
+        self.visible = page
+        self.wake()
+
+    def runnable(self, task):
+        return task.page is None or task.page is self.visible
+
+    # Current interval of a task, adapted to the latency of its queries
+    def interval_of(self, task):
+        if task.latency is None:
+            return task.interval
+        return min(max(task.interval, task.latency() * self.latency_factor), task.max_interval)
+
+    # Run the due tasks (in the order they were added) and wait for the next one
+    def tick(self):
+        self.timer = None
+        now = time.monotonic()
+        for task in self.tasks:
+            if not self.runnable(task) or task.next_due > now + self.coalesce:
+                continue
+
+            if task.busy is not None and task.busy():
+                task.skipped = task.skipped + 1
+            else:
+                try:
+                    task.function()
+                except Exception as e:
+                    print("Scheduler: {} failed ({})".format(task.name, e))
+                task.runs = task.runs + 1
+            task.next_due = now + self.interval_of(task)
+
+        self.report()
+        self.schedule()
+
+    def schedule(self):
+        if self.after is None:
+            return
+        due = [task.next_due for task in self.tasks if self.runnable(task)]
+        if not due:
+            return
+        delay = max(0.0, min(due) - time.monotonic())
+        self.timer = self.after(int(delay * 1000), self.tick)
+
+    # Tick again at once, e.g. when another page is shown
+    def wake(self):
+        if self.after is None:
+            return
+        if self.timer is not None:
+            self.after_cancel(self.timer)
+        self.timer = self.after(0, self.tick)
+
+    # Print runs, skipped ticks and the current interval of every task every report interval
+    def report(self):
+        now = time.monotonic()
+        if not self.report_interval or now - self.last_report < self.report_interval:
+            return
+        print("Scheduler: " + ", ".join("{} {} runs {} skipped every {:.1f} sec".format(
+            task.name, task.runs, task.skipped, self.interval_of(task)) for task in self.tasks))
+        for task in self.tasks:
+            task.runs = 0
+            task.skipped = 0
+        self.last_report = now
+
+
+# Stands in for the matplotlib timer of a FuncAnimation (its event_source), so the animation's frames are
+# the ticks of a scheduler task: add fire() as the task's function
+class AnimationTimer:
+
+    def __init__(self, interval):
+        self.interval = interval   # millisec, only kept for the animation
+        self.callbacks = []
+        self.running = False
+
+    def add_callback(self, func, *args, **kwargs):
+        self.callbacks.append((func, args, kwargs))
+        return func
+
+    def remove_callback(self, func, *args, **kwargs):
+        for callback in list(self.callbacks):
+            if callback[0] == func and (not args and not kwargs or callback[1:] == (args, kwargs)):
+                self.callbacks.remove(callback)
+
+    def start(self, interval=None):
+        if interval is not None:
+            self.interval = interval
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    # A callback that returns 0 (or False) is removed, like with matplotlib's timers
+    def fire(self):
+        if not self.running:
+            return
+        for func, args, kwargs in list(self.callbacks):
+            if func(*args, **kwargs) == 0:
+                self.callbacks.remove((func, args, kwargs))
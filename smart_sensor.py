@@ -1,38 +1,121 @@
 """
 MQTT Publisker - Works as Smart Sensor
+
+Usage: python smart_sensor.py [--speed 60 | --fast] [--start 2012-06-01] [--end 2013-01-13] [--batch-size N]
 """
 
-from csv import reader
+import argparse
 import time
-import pandas as pd
-import os
 
 import paho.mqtt.client as mqtt
+import payload
+import watt_data
 
-# Connect to the MQTT broker
+# MQTT broker config
 MQTT_BROKER_URL    = "mqtt.eclipseprojects.io"
 MQTT_PUBLISH_TOPIC = "electricity"
 
-mqttc = mqtt.Client()
-mqttc.connect(MQTT_BROKER_URL)
-
-# Change directory where data are stored locally
-data_directory = os.path.abspath("watt_data")
-os.chdir(data_directory)
-
-# Specific dates to open data files in order
-datelist = pd.date_range("2012-06-01", "2013-01-13").strftime('%Y-%m-%d').to_list()
-
-# Loop through data sent to the Broker
-for date in datelist:
-    print("--------------------------------------------------------------")
-    print(f"------------------------- {date} -------------------------")
-    print("--------------------------------------------------------------")
-
-    # Iterate over each line as an ordered dictionary and publish only column that contains electricity consumption value
-    with open('{}.csv'.format(date), 'r') as read_obj:
-        csv_reader = reader(read_obj)
-        for row in csv_reader:
-            mqttc.publish(MQTT_PUBLISH_TOPIC, row[0])
-            print(f"Published new electricity measurement: {row[0]}")
-            time.sleep(1)
\ No newline at end of file
+
+# Drift-free pacing - tick k is due at start + k / rate, so a slow publish doesn't delay the following ones
+class Pacer:
+
+    def __init__(self, rate):
+        # rate = ticks per sec, None = as fast as possible
+        self.interval = 1 / rate if rate else 0
+        self.start = time.monotonic()
+        self.ticks = 0
+
+    # Wait until the next tick is due
+    def wait(self):
+        self.ticks = self.ticks + 1
+        if not self.interval:
+            return
+        delay = self.start + self.ticks * self.interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Measurements of the data files in order, as (data timestamp secs, watt). Row i of a day was measured at midnight + i secs
+def readings(start=watt_data.FIRST_DAY, end=watt_data.LAST_DAY, directory=watt_data.WATT_DATA_DIRECTORY):
+    for date in watt_data.days(start, end):
+        print("--------------------------------------------------------------")
+        print(f"------------------------- {date} -------------------------")
+        print("--------------------------------------------------------------")
+
+        start_timestamp = watt_data.day_start_timestamp(date)
+        for i, value in enumerate(watt_data.read_day(date, directory)):
+            yield start_timestamp + i, value
+
+
+# Command line options
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay watt_data measurements to the MQTT broker")
+    parser.add_argument("--speed", type=float, default=1,
+                        help="replay speed multiplier, e.g. 60 sends one hour of data per minute (default 1 = real time)")
+    parser.add_argument("--fast", action="store_true", help="publish as fast as possible")
+    parser.add_argument("--start", default=watt_data.FIRST_DAY, help="first day to replay (default %(default)s)")
+    parser.add_argument("--end", default=watt_data.LAST_DAY, help="last day to replay (default %(default)s)")
+    parser.add_argument("--data-directory", default=watt_data.WATT_DATA_DIRECTORY, help="directory of the day files")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="readings per MQTT message, more than 1 sends compact binary batches (default 1)")
+    parser.add_argument("--timestamps", choices=("now", "data"),
+                        help="stamp readings with the publish time or with the time in the data files "
+                             "(default: now in real time, data when time-compressed, since readings "
+                             "less than a second apart would overwrite each other)")
+    parser.add_argument("--report-interval", type=float, default=10, help="secs between rate reports (default %(default)s)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    real_time = args.speed == 1 and not args.fast
+    use_data_timestamps = args.timestamps == "data" or (args.timestamps is None and not real_time)
+
+    # Connect to the MQTT broker
+    mqttc = mqtt.Client()
+    mqttc.connect(MQTT_BROKER_URL)
+    mqttc.loop_start()
+
+    # One tick per reading, `speed` readings per sec
+    pacer = Pacer(None if args.fast else args.speed)
+
+    published = 0
+    last_report = time.monotonic()
+    published_at_last_report = 0
+    batch = []
+
+    # Loop through data sent to the Broker
+    for data_timestamp, value in readings(args.start, args.end, args.data_directory):
+        pacer.wait()
+        timestamp = data_timestamp if use_data_timestamps else time.time()
+
+        if args.batch_size > 1:
+            # Collect readings and send them together in one binary message
+            batch.append((timestamp, value))
+            if len(batch) >= args.batch_size:
+                mqttc.publish(MQTT_PUBLISH_TOPIC, payload.encode_batch(batch))
+                batch = []
+        else:
+            # Send the value together with the time it was measured
+            mqttc.publish(MQTT_PUBLISH_TOPIC, payload.encode_reading(timestamp, value))
+        published = published + 1
+
+        # Report achieved rate instead of printing every reading
+        now = time.monotonic()
+        if now - last_report >= args.report_interval:
+            rate = (published - published_at_last_report) / (now - last_report)
+            print(f"Published {published} electricity measurements ({rate:.1f}/sec), last: {value}")
+            last_report = now
+            published_at_last_report = published
+
+    # Send what is left at the end
+    if batch:
+        mqttc.publish(MQTT_PUBLISH_TOPIC, payload.encode_batch(batch))
+
+    print(f"Published {published} electricity measurements")
+    mqttc.disconnect()
+    mqttc.loop_stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+Watt Data - Daily measurement files (watt_data/YYYY-MM-DD.csv, one reading per second)
+"""
+
+import os
+import time
+from csv import reader
+from datetime import date, timedelta
+
+# Data files config
+WATT_DATA_DIRECTORY = "watt_data"
+FIRST_DAY = "2012-06-01"
+LAST_DAY = "2013-01-13"
+
+
+# Days from start to end (both included) as YYYY-MM-DD strings
+def days(start=FIRST_DAY, end=LAST_DAY):
+    day = date.fromisoformat(start)
+    last = date.fromisoformat(end)
+    result = []
+    while day <= last:
+        result.append(day.strftime("%Y-%m-%d"))
+        day = day + timedelta(days=1)
+    return result
+
+# Path of the data file of a day
+def day_file(day, directory=WATT_DATA_DIRECTORY):
+    return os.path.join(directory, "{}.csv".format(day))
+
+# Electricity consumption values of a day, the first column of every row
+def read_day(day, directory=WATT_DATA_DIRECTORY):
+    with open(day_file(day, directory), "r") as read_obj:
+        return [row[0] for row in reader(read_obj) if row]
+
+# Unix time (secs) of local midnight of a day - row i of the day file was measured at this time + i secs
+def day_start_timestamp(day):
+    return int(time.mktime(date.fromisoformat(day).timetuple()))
@@ -1,29 +1,36 @@
 """
 Watt Matters App
+
+Run it with `python watt_matters_app.py`. Importing the module has no side effects: matplotlib is loaded and
+the window is built by main(), the InfluxDB client is created by the first query and paho-mqtt is only
+imported when LIVE_SOURCE=mqtt.
 """
 
-import matplotlib
-matplotlib.use("TkAgg")
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
-import matplotlib.animation as animation
-from matplotlib import style
+# Startup timing starts before the imports
+import time
+STARTUP_TIME = time.perf_counter()
 
 import tkinter as tk
 from tkinter import *
 
 import os
 from dotenv import load_dotenv
-from influxdb_client import InfluxDBClient
 
 import datetime
 from datetime import date
-import time
+from collections import deque
 
-import sqlite3
-import pandas as pd
 import numpy as np
 
+import daily_totals
+import insights
+from data_service import DataService
+from query_cache import RangeCache
+from scheduler import Scheduler, AnimationTimer
+import live_data
+import payload
+import rollups
+
 #Color Values Reference
 WHITE = "#ffffff"
 GOLD = "#f8cb05"
@@ -33,12 +40,21 @@ VERY_LIGHT_BLUE = "#cdd7ff"
 DARK_GREY = "#b7b7b7"
 LIGHT_GREY = "#e3e3e3"
 
-# Matplotlib style
-style.use("ggplot")
-
 # Take environment variables from .env.
 load_dotenv()
 
+# Seconds since startup of: imports done, window shown, first live chart drawn
+startup_times = {}
+
+# Record a startup milestone, the report is printed once all of them are reached
+def startup_mark(name):
+    if name in startup_times:
+        return
+    startup_times[name] = time.perf_counter() - STARTUP_TIME
+    if len(startup_times) == 3:
+        print("Startup: imports {:.2f} sec, window shown {:.2f} sec, first chart drawn {:.2f} sec".format(
+            startup_times["imports"], startup_times["window shown"], startup_times["first chart drawn"]))
+
 
 class WattMattersApp(tk.Tk):
 
@@ -61,13 +77,13 @@ class WattMattersApp(tk.Tk):
         container.grid_rowconfigure(0, weight=1)
         container.grid_columnconfigure(0, weight=1)
 
-        # Rotate between 4 pages(Energy, History, Insights, Profile)
+        # Rotate between 4 pages(Energy, History, Insights, Profile).
+        # A page is built the first time it is shown, and its data is loaded from then on
+        self.container = container
         self.frames = {}
 
-        for F in (EnergyPage, HistoryPage, InsightsPage, ProfilePage):
-            frame = F(container, self)
-            self.frames[F] = frame
-            frame.grid(row=0, column=0, sticky="nsew")
+        # Report startup times once the window is on screen
+        self.bind("<Map>", lambda event: startup_mark("window shown"), add="+")
 
         # On start show Energy Page
         self.show_frame(EnergyPage)
@@ -75,26 +91,123 @@ class WattMattersApp(tk.Tk):
     # Function that brings selected Page on top
     def show_frame(self, cont):
 
-        frame = self.frames[cont]
+        frame = self.frames.get(cont)
+        if frame is None:
+            start = time.perf_counter()
+            frame = cont(self.container, self)
+            self.frames[cont] = frame
+            frame.grid(row=0, column=0, sticky="nsew")
+            print("{} built in {:.1f} ms".format(cont.__name__, (time.perf_counter() - start) * 1000))
+
+        # Only the periodic work of the shown page runs - its due refreshes (the first data of a new page,
+        # placeholders are shown until it arrives) run at once
         frame.tkraise()
+        scheduler.show(cont)
+
+
+# All periodic work (live feed, live chart, tables, queries) runs from one scheduler on the Tk main loop.
+# Work of hidden pages is paused and the interval of a query grows to SCHEDULER_LATENCY_FACTOR times its latency
+scheduler = Scheduler(latency_factor=float(os.getenv('SCHEDULER_LATENCY_FACTOR', 3)),
+                      report_interval=float(os.getenv('SCHEDULER_REPORT_INTERVAL', 300)))
+LIVE_INTERVAL = 1.0       # secs
+USAGE_TABLE_INTERVAL = 20
+INSIGHTS_INTERVAL = 20
 
 
 # InfluxDB config
 BUCKET = os.getenv('INFLUXDB_BUCKET')
-client = InfluxDBClient(url=os.getenv('INFLUXDB_LOCALHOST_URL'),
+
+# InfluxDB client, created on a data service thread by the first query so it doesn't delay the window
+def connect_influxdb():
+    from influxdb_client import InfluxDBClient
+    return InfluxDBClient(url=os.getenv('INFLUXDB_LOCALHOST_URL'),
                 token=os.getenv('INFLUXDB_TOKEN'), org=os.getenv('INFLUXDB_ORG'))
-write_api = client.write_api()
 
-# Function that is querying the InfluxDB Time Series Database obtaining latest stored value
-def query_latest_value_influxDB():
-    # Query script - get last value
-    query_api = client.query_api()
+# InfluxDB and SQLite queries run on the data service's threads, never on the Tk main loop.
+# It owns the client and reuses one query api, results are handed back by the scheduler's "data-service" task
+DATA_SERVICE_POLL_INTERVAL = 0.05  # secs
+DATA_SERVICE_WORKERS = int(os.getenv('DATA_SERVICE_WORKERS', 4))
+data_service = None
+
+# Household shown by the app. Readings of the single "electricity" topic are stored without device tag,
+# readings of "electricity/<device>" topics are tagged with their device (household) id
+HOUSEHOLD_ID = os.getenv('HOUSEHOLD_ID', daily_totals.DEFAULT_HOUSEHOLD)
+HOUSEHOLD_FILTER = insights.household_filter(HOUSEHOLD_ID, daily_totals.DEFAULT_HOUSEHOLD)
+
+# Insights statistics are aggregated by InfluxDB ("server"), from the raw measurements in the app ("client")
+# or seeded once from InfluxDB and then updated with every live reading ("incremental")
+INSIGHTS_AGGREGATION = os.getenv('INSIGHTS_AGGREGATION', insights.SERVER)
+
+# Read Insights from the rollups the consumer keeps ("rollup") instead of the raw measurements ("raw")
+INSIGHTS_SOURCE = os.getenv('INSIGHTS_SOURCE', 'raw')
+INSIGHTS_TIERS = rollups.TIERS if INSIGHTS_SOURCE == 'rollup' else ()
+
+# Insights ranges (hours)
+INSIGHTS_RANGE_HOURS = {"-168h": 168, "-730h": 730}
+
+# The client aggregation keeps the month of raw readings in memory: the week is served from it and every
+# refresh only fetches the readings since the last one (INSIGHTS_CACHE=0 queries both ranges every time)
+def fetch_insights_readings(start, stop):
+    return insights.query_values_between(data_service.query_api, os.getenv('INFLUXDB_ORG'), start, stop, HOUSEHOLD_FILTER)
+
+insights_cache = None
+if INSIGHTS_AGGREGATION == insights.CLIENT and os.getenv('INSIGHTS_CACHE', '1') == '1':
+    insights_cache = RangeCache(fetch_insights_readings, horizon=max(INSIGHTS_RANGE_HOURS.values()) * 3600,
+                                report_interval=float(os.getenv('INSIGHTS_CACHE_REPORT_INTERVAL', 300)), name="insights")
+
+# Rolling Insights windows of the incremental mode (hours)
+INSIGHTS_WINDOWS = {"-168h": insights.SlidingWindowStatistics(168), "-730h": insights.SlidingWindowStatistics(730)}
+insights_seeded = False
+insights_seed_started = None    # readings until then are in the seed
+insights_seed_time = None       # monotonic time of the last seed
+
+# The windows are seeded again every INSIGHTS_RESEED_INTERVAL secs (readings written late show up too)
+# and after the live feed missed readings
+INSIGHTS_RESEED_INTERVAL = float(os.getenv('INSIGHTS_RESEED_INTERVAL', 3600))
+insights_gap = False
+
+# Readings added while a seed query runs, they are added to the new windows too if they aren't in the seed
+insights_recent = []
+
+# Newest reading timestamp of the live feed (secs), None until the window was backfilled
+live_last_time = None
+
+# True once the first fetch of the chart window completed - also when it returned no readings or failed (MQTT)
+live_backfilled = False
+
+# Where new live readings come from: "influxdb" (polled every second) or "mqtt" (pushed by the broker as the
+# sensor publishes them, InfluxDB is then only used to backfill the chart window on start)
+LIVE_SOURCE = os.getenv('LIVE_SOURCE', 'influxdb')
+MQTT_BROKER_URL = os.getenv('MQTT_BROKER_URL', "mqtt.eclipseprojects.io")
+MQTT_PUBLISH_TOPIC = "electricity"
+
+# Readings received over MQTT (thread-safe, filled by the MQTT network thread, drained on the Tk main loop).
+# When the UI can't keep up the oldest readings are dropped, the chart never shows more than its window anyway
+live_queue = deque(maxlen=int(os.getenv('LIVE_WINDOW', 3600)))
+live_mqttc = None
+
+# A longer pause between two readings is drawn as a gap in the live chart (secs)
+LIVE_GAP = float(os.getenv('LIVE_GAP', 5))
+
+# Readings can become visible in InfluxDB after newer ones (the consumer's batch writer flushes every second,
+# workers of a shared subscription flush independently). Every poll fetches the last LIVE_OVERLAP secs again,
+# readings are told apart by their timestamps
+LIVE_OVERLAP = float(os.getenv('LIVE_OVERLAP', 5))
+live_seen = set()   # timestamps of the readings of the last LIVE_OVERLAP secs
+
+# Function that is querying the InfluxDB Time Series Database obtaining the values stored after `since` (secs)
+# minus the overlap, or those of the last `window` secs on the first call - only that narrow range is scanned,
+# never the whole bucket
+def query_new_values_influxDB(since, window):
+    start = str(int(since - LIVE_OVERLAP)) if since is not None else '-' + str(int(window)) + 's'
+    query_api = data_service.query_api
     query = 'from(bucket: "electricity")\
-        |> range(start:1, stop: now())\
+        |> range(start:' + start + ', stop: now())\
         |> filter(fn: (r) =>\
             r._measurement == "electricity"\
-        )\
-        |> last()'
+        )' + HOUSEHOLD_FILTER + '\
+        |> keep(columns: ["_time", "_value"])\
+        |> sort(columns: ["_time"])'
 
     # Query InfluxDB database
     result = query_api.query(org=os.getenv('INFLUXDB_ORG'), query=query)
@@ -104,47 +217,209 @@ def query_latest_value_influxDB():
     for table in result:
         for record in table.records:
             value.append((record.get_value()))
-            time.append((record.get_time()))
+            time.append((record.get_time().timestamp()))
 
     return value, time
 
-# Read from file and store in Global variable to keep track of total watt usage
-with open("total-watt.csv", "r") as file:
-    last_line = file.readlines()[-1]
-    currentline = last_line.split(",")
-    total_watt = int(currentline[1])
-    running_hours = float(currentline[2])
+# Global variables to keep track of today's total watt usage, read from the daily totals store on a data service
+# thread (opening the store may migrate it and waits for the consumer's lock). Live readings are only counted
+# once they were read, so none is counted twice or missed
+total_watt = 0
+running_hours = 0
+today_totals_read = False
+
+# Today's (usage, runtime hours) from the daily totals store (data service thread)
+def query_today_totals(household):
+    totals_conn = daily_totals.connect()
+    try:
+        return daily_totals.get_day(totals_conn, date.today().strftime("%Y-%m-%d"), household)
+    finally:
+        totals_conn.close()
+
+def show_today_totals(totals):
+    global total_watt
+    global running_hours
+    global today_totals_read
+    total_watt, running_hours = totals
+    today_totals_read = True
 
-# Create figure for plotting
-f = Figure(figsize=(5,5), dpi=100)
-f.set_facecolor(LIGHT_GREY)
-a = f.add_subplot(111)
-xs = []
-ys = []
+# Without the stored totals today's usage starts at zero
+def today_totals_failed(e):
+    global today_totals_read
+    print("Today's totals: reading the daily totals store failed ({})".format(e))
+    today_totals_read = True
+
+def read_today_totals():
+    data_service.submit("today-totals", query_today_totals, HOUSEHOLD_ID, callback=show_today_totals, errback=today_totals_failed)
+
+# Figure and axes of the live chart, created by create_live_chart()
+f = None
+a = None
 
-# This function is called periodically(every 1 sec) from FuncAnimation
-def animate(i, xs, ys):
+# Live chart window (secs) - the chart keeps the readings of this window in a fixed-size ring buffer
+LIVE_WINDOW = int(os.getenv('LIVE_WINDOW', 3600))
+live_readings = live_data.RingBuffer(LIVE_WINDOW)
 
-    # Add x and y to lists
-    value, time = query_latest_value_influxDB()
-    xs.append(time[0])
-    ys.append(value[0])
+# Matplotlib date number of the unix epoch, to plot timestamps in secs as dates
+EPOCH_DATENUM = None
 
-    # Keep track of total watt consumed
+# Create figure for plotting
+def create_live_chart():
+    global f
+    global a
+    global EPOCH_DATENUM
+    from matplotlib.figure import Figure
+    import matplotlib.dates as mdates
+
+    f = Figure(figsize=(5,5), dpi=100)
+    f.set_facecolor(LIGHT_GREY)
+    a = f.add_subplot(111)
+    EPOCH_DATENUM = mdates.date2num(datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc))
+
+# Live chart rendering: "blit" creates the line and fill once and redraws only them every frame,
+# "full" clears and redraws the whole figure every frame
+LIVE_CHART_RENDERING = os.getenv('LIVE_CHART_RENDERING', 'blit')
+LIVE_CHART_REPORT_INTERVAL = float(os.getenv('LIVE_CHART_REPORT_INTERVAL', 60))   # secs, 0 = no report
+
+# Blitted x-axis shows the window plus 10% headroom on the right, so it only has to move when that is used up
+LIVE_CHART_HEADROOM = 0.1
+
+# Render time of live chart frames
+frame_stats = {"start": None, "frames": 0, "seconds": 0.0, "max": 0.0, "full_redraws": 0, "last_report": time.monotonic()}
+
+# The callback for when a PUBLISH message is received from the broker (MQTT network thread)
+def on_live_message(client, userdata, msg):
+    try:
+        readings = payload.decode(msg.payload, time.time())
+    except ValueError as e:
+        # Anyone can publish to the topic, a malformed payload must not stop the network thread
+        print("Live readings: dropped malformed payload ({}): {!r}".format(e, msg.payload[:64]))
+        return
+    live_queue.extend(readings)
+
+# Subscribe to the readings of the household on a background thread
+def start_live_subscriber():
+    global live_mqttc
+    topic = MQTT_PUBLISH_TOPIC
+    if HOUSEHOLD_ID != daily_totals.DEFAULT_HOUSEHOLD:
+        topic = MQTT_PUBLISH_TOPIC + "/" + HOUSEHOLD_ID
+
+    import paho.mqtt.client as mqtt
+    live_mqttc = mqtt.Client()
+    live_mqttc.on_connect = lambda client, userdata, flags, rc: client.subscribe(topic)
+    live_mqttc.on_message = on_live_message
+    live_mqttc.connect_async(MQTT_BROKER_URL)
+    live_mqttc.loop_start()
+
+def stop_live_subscriber():
+    if live_mqttc is not None:
+        live_mqttc.disconnect()
+        live_mqttc.loop_stop()
+
+# Readings received over MQTT since the last call as (values, timestamps)
+def drain_live_queue():
+    value = []
+    time = []
+    while live_queue:
+        timestamp, measurement = live_queue.popleft()
+        value.append(measurement)
+        time.append(timestamp)
+    return value, time
+
+# Get the readings stored since the last frame: drained from the MQTT queue, or fetched from InfluxDB
+# on a data service thread (a fetch that is still running isn't started again)
+def request_live_readings(live_readings):
+    if not today_totals_read:
+        return
+    if LIVE_SOURCE == 'mqtt' and live_backfilled:
+        add_live_readings(live_readings, *drain_live_queue())
+    elif not data_service.busy("live"):
+        # After a long pause only the readings of the chart window are fetched
+        since = live_last_time
+        if since is not None and since < datetime.datetime.now().timestamp() - LIVE_WINDOW:
+            since = datetime.datetime.now().timestamp() - LIVE_WINDOW
+            insights_missed_readings()
+        data_service.submit("live", query_new_values_influxDB, since, LIVE_WINDOW,
+                            callback=lambda result: add_live_readings(live_readings, *result), errback=live_readings_failed)
+
+# A failed fetch is retried at the next tick. With MQTT a failed backfill doesn't hold up the pushed readings,
+# the chart then starts with them
+def live_readings_failed(e):
+    global live_backfilled
+    print("Live readings: query failed ({})".format(e))
+    if LIVE_SOURCE == 'mqtt':
+        live_backfilled = True
+
+# Add new (values, timestamps) readings to the live chart data and today's totals.
+# The readings of the first completed fetch backfill the chart window instead (they are already in today's totals),
+# even when it returned none: everything after it is new
+def add_live_readings(live_readings, value, time):
+    global live_last_time
+    global live_backfilled
+    global live_seen
     global total_watt
-    total_watt = total_watt + value[0]
     global running_hours
-    running_hours = running_hours + 0.000278
 
-    # Limit x and y lists to 3600 items (Keep metrics for last 3600 secs = 1 hour)
-    xs = xs[-3600:]
-    ys = ys[-3600:]
-
-    # Draw x and y lists
+    backfill = not live_backfilled
+    for timestamp, measurement in zip(time, value):
+        if timestamp in live_seen:
+            continue
+        if live_last_time is not None and timestamp <= live_last_time:
+            if backfill:
+                continue
+            if timestamp <= live_last_time - LIVE_OVERLAP:
+                # Too old to tell whether it was counted already, the Insights windows are seeded again
+                insights_missed_readings()
+                continue
+
+            # Became visible late - too late for the chart, but it counts for today's totals and Insights
+            live_seen.add(timestamp)
+            if INSIGHTS_AGGREGATION == insights.INCREMENTAL:
+                add_insights_reading(timestamp, measurement)
+            total_watt = total_watt + measurement
+            running_hours = running_hours + 0.000278
+            continue
+
+        # Readings are missing (sensor or consumer was down) - break the line instead of joining across the gap
+        if live_last_time is not None and timestamp - live_last_time > LIVE_GAP:
+            live_readings.append(live_last_time + 1, np.nan)
+            if not backfill:
+                insights_missed_readings()
+        live_readings.append(timestamp, measurement)
+        live_last_time = timestamp
+        live_seen.add(timestamp)
+
+        if backfill:
+            continue
+
+        # Keep the incremental Insights windows up to date
+        if INSIGHTS_AGGREGATION == insights.INCREMENTAL:
+            add_insights_reading(timestamp, measurement)
+
+        # Keep track of total watt consumed
+        total_watt = total_watt + measurement
+        running_hours = running_hours + 0.000278
+
+    live_backfilled = True
+    if live_last_time is not None:
+        live_seen = {timestamp for timestamp in live_seen if timestamp > live_last_time - LIVE_OVERLAP}
+
+# Readings of the live chart window as (matplotlib dates, values)
+def live_chart_data(live_readings):
+    timestamps, ys = live_readings.view()
+    return timestamps / 86400.0 + EPOCH_DATENUM, ys
+
+# This function is called periodically(every 1 sec, while the Energy page is shown) from FuncAnimation
+def animate(i, live_readings):
+    frame_started()
+
+    # Draw the readings of the window (at most LIVE_WINDOW points, however long the app runs)
+    xs, ys = live_chart_data(live_readings)
     a.clear()
     a.plot(xs, ys, DARK_BLUE)
+    a.xaxis_date()
     a.set_facecolor(LIGHT_GREY)
-    a.fill_between(xs, 0, ys, color=LIGHT_BLUE, alpha=0.5)
+    a.fill_between(xs, 0, np.nan_to_num(ys), color=LIGHT_BLUE, alpha=0.5)
 
     # Rotate x-axis labels
     for tick in a.get_xticklabels():
@@ -156,6 +431,94 @@ def animate(i, xs, ys):
     a.set_ylabel('Watt')
     a.set_xlabel('Time (sec)')
 
+# Artists of the blitted live chart, created once and updated in place
+live_line = None
+live_fill = None
+
+# Static parts of the blitted live chart - FuncAnimation calls this before the first frame and after a resize
+def init_live_chart():
+    global live_line
+    global live_fill
+    if live_line is None:
+        live_line, = a.plot([], [], DARK_BLUE)
+        live_fill = a.fill_between([0, 1], 0, [0, 0], color=LIGHT_BLUE, alpha=0.5)
+        a.xaxis_date()
+        a.set_facecolor(LIGHT_GREY)
+        a.tick_params(axis='x', labelrotation=45)
+        a.set_ylabel('Watt')
+        a.set_xlabel('Time (sec)')
+        a.set_title('Live Energy Usage Diagram\n' + date.today().strftime("%d %B %Y"))
+        live_fill.set_verts([])
+    return live_line, live_fill
+
+# Move the axes only when the data left them (or the day changed), which needs a full redraw of the figure
+def rescale_live_chart(xs, ys):
+    changed = False
+
+    span = LIVE_WINDOW / 86400.0
+    left, right = a.get_xlim()
+    if xs[-1] > right or xs[-1] < right - span * (1 + LIVE_CHART_HEADROOM):
+        right = xs[-1] + span * LIVE_CHART_HEADROOM
+        a.set_xlim(right - span * (1 + LIVE_CHART_HEADROOM), right)
+        changed = True
+
+    peak = np.nanmax(ys) if len(ys) else 0
+    top = a.get_ylim()[1]
+    if peak > top or peak < top / 2:
+        a.set_ylim(0, max(peak, 1) * 1.2)
+        changed = True
+
+    title = 'Live Energy Usage Diagram\n' + date.today().strftime("%d %B %Y")
+    if a.get_title() != title:
+        a.set_title(title)
+        changed = True
+
+    if changed:
+        # The line and fill are animated artists, the full draw only renders the background FuncAnimation blits onto
+        f.canvas.draw()
+        frame_stats["full_redraws"] = frame_stats["full_redraws"] + 1
+
+# This function is called periodically(every 1 sec, while the Energy page is shown) from FuncAnimation when blitting
+def animate_blit(i, live_readings):
+    frame_started()
+
+    xs, ys = live_chart_data(live_readings)
+    if not len(xs):
+        return live_line, live_fill
+    rescale_live_chart(xs, ys)
+
+    # Update the line and the fill polygon in place (the fill drops to 0 in gaps)
+    live_line.set_data(xs, ys)
+    live_fill.set_verts([np.concatenate(([[xs[0], 0]], np.column_stack((xs, np.nan_to_num(ys))), [[xs[-1], 0]]))])
+    return live_line, live_fill
+
+# Start timing a live chart frame. A blitted frame is on the canvas once Tk is idle again,
+# a full frame when its draw_event fires
+def frame_started():
+    frame_stats["start"] = time.perf_counter()
+    if LIVE_CHART_RENDERING == 'blit':
+        app.after_idle(frame_drawn)
+
+# Record the render time of the frame and print a report every LIVE_CHART_REPORT_INTERVAL secs
+def frame_drawn(event=None):
+    start = frame_stats["start"]
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    frame_stats["start"] = None
+    frame_stats["frames"] = frame_stats["frames"] + 1
+    frame_stats["seconds"] = frame_stats["seconds"] + elapsed
+    frame_stats["max"] = max(frame_stats["max"], elapsed)
+    if len(live_readings):
+        startup_mark("first chart drawn")
+
+    now = time.monotonic()
+    if LIVE_CHART_REPORT_INTERVAL and now - frame_stats["last_report"] >= LIVE_CHART_REPORT_INTERVAL:
+        print("Live chart ({}): {} frames, render avg {:.1f} ms max {:.1f} ms, {} full redraws".format(
+            LIVE_CHART_RENDERING, frame_stats["frames"], frame_stats["seconds"] / frame_stats["frames"] * 1000,
+            frame_stats["max"] * 1000, frame_stats["full_redraws"]))
+        frame_stats.update(frames=0, seconds=0.0, max=0.0, full_redraws=0, last_report=now)
+
 # Electricity usage table
 def draw_usage_table(self):
     global text_watt
@@ -193,8 +556,8 @@ def draw_usage_table(self):
     frame_usage_money.pack_propagate(False) 
     label_usage_money.place(relx=0.5, rely=0.5, anchor=CENTER)
 
-# Refresh electricity usage table every 20 secs
-def usageTableRefresher():
+# Refresh electricity usage table (every 20 secs while the Energy page is shown)
+def refresh_usage_table():
 
     # kWh = ( (wattsPerSec ÷ 3600) × hrs) ÷ 1,000
     kWh = round(((total_watt / 3600) * running_hours) / 1000, 3)
@@ -203,8 +566,6 @@ def usageTableRefresher():
     price = round(kWh * 0.12, 3)
     text_price.set(str(price) +  " €")
 
-    app.after(20000, usageTableRefresher) # every 20 seconds...
-
 
 class EnergyPage(tk.Frame):
 
@@ -224,6 +585,7 @@ class EnergyPage(tk.Frame):
         frame_graph.place(x=0, y=150)
         frame_graph.pack_propagate(False)
 
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
         canvas = FigureCanvasTkAgg(f, frame_graph)
         canvas.draw()
         canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=True)
@@ -271,46 +633,59 @@ class EnergyPage(tk.Frame):
         button_menu_profile.place(x=450, y=900)
 
 
-# Plot history diagram
-def history_diagram(self):
-    # Load data file
-    df = pd.read_csv('total-watt.csv')
+# History page config: days shown and how often the daily totals are checked for changes (secs)
+HISTORY_DAYS = 10
+HISTORY_REFRESH_INTERVAL = float(os.getenv('HISTORY_REFRESH_INTERVAL', 60))
 
-    # Create/connect to a SQLite database
-    conn = sqlite3.connect("watt_matters.db")
+# One SQLite connection for the History page, used by one data service thread at a time, and what it saw last
+history_conn = None
+history_seen = {"data_version": None, "before": None, "rows": None}
 
-    # Create a cursor
-    c = conn.cursor()
+# Last 10 days of a household (before today) as (dates, kWh) lists, None if they didn't change since the last call -
+# runs on a data service thread
+def query_history(household):
+    global history_conn
+    if history_conn is None:
+        # Connect to the SQLite database (the consumer keeps the daily totals up to date with upserts per day)
+        history_conn = daily_totals.connect(check_same_thread=False)
 
-    # Load datafile to SQLire
-    df.to_sql('total_usage', conn, if_exists='replace')
+    # data_version only changes when another connection (the consumer) committed, skip the query until then
+    before = datetime.date.today().strftime("%Y-%m-%d")
+    data_version = history_conn.execute("PRAGMA data_version").fetchone()[0]
+    if data_version == history_seen["data_version"] and before == history_seen["before"]:
+        return None
 
+    # Read the 10 days right from the (household, dates) primary key - a range scan of 10 index entries,
+    # nothing is copied or sorted however many days are stored
+    rows = daily_totals.last_days(history_conn, household, HISTORY_DAYS, before=before)
+    history_seen.update(data_version=data_version, before=before)
+
+    # The consumer commits every second, the shown days only change once in a while
+    if rows == history_seen["rows"]:
+        return None
+    history_seen["rows"] = rows
 
-    # Query database
-    query = "SELECT * FROM ( SELECT * FROM total_usage ORDER BY dates DESC LIMIT 11) ORDER BY dates ASC" # 11 = 10 last days + today
     date = []
     value = []
-    # Execute query & store results
-    for row in c.execute(query):
-        date.append(row[1])
-        value.append(round(((row[2] / 3600) * row[3]) / 1000, 3))
-
-    # Remove today value
-    date.pop();
-    value.pop();
+    for day, usage, runtime_hours in rows:
+        date.append(day)
+        value.append(round(((usage / 3600) * runtime_hours) / 1000, 3))
+    return date, value
 
-    # Commit command
-    conn.commit()
-
-    # Close connection
-    conn.close()
+# History graph of the last 10 days - the figure, its bars and the canvas are created once and updated in place
+def history_diagram(self):
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    from matplotlib.figure import Figure
 
     # Plot last 10 days History Graph
     fh = Figure(figsize=(5,5), dpi=100)
     fh.set_facecolor(LIGHT_GREY)
     a = fh.add_subplot(111)
-    a.bar(date, value, color=LIGHT_BLUE)
+    self.history_bars = a.bar(range(HISTORY_DAYS), [0] * HISTORY_DAYS, color=LIGHT_BLUE)
     a.set_facecolor(LIGHT_GREY)
+    a.set_xticks(range(HISTORY_DAYS))
+    a.set_xticklabels([""] * HISTORY_DAYS)
+    self.history_loading = a.text(0.5, 0.5, "Loading...", transform=a.transAxes, ha="center", va="center", color=DARK_BLUE)
 
     # Format plot
     a.set_title('Energy Usage History\nlast 10 days')
@@ -318,8 +693,7 @@ def history_diagram(self):
     a.set_xlabel('Date')
 
     # Rotate x-axis labels
-    for tick in a.get_xticklabels():
-        tick.set_rotation(50)
+    a.tick_params(axis='x', labelrotation=50)
 
     # Frame to place history graph canvas
     frame_history_graph = Frame(self, height=720, width=600, bg=LIGHT_GREY, bd=1, relief=FLAT)
@@ -331,6 +705,30 @@ def history_diagram(self):
     canvas.draw()
     canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=True)
 
+    self.history_axes = a
+    self.history_canvas = canvas
+
+# Show new daily totals in the history graph (oldest day first, fewer than 10 days leave the first bars empty)
+def update_history_diagram(self, date, value):
+    padding = HISTORY_DAYS - len(date)
+    labels = [""] * padding + date
+    heights = [0] * padding + value
+    for bar, height in zip(self.history_bars, heights):
+        bar.set_height(height)
+    self.history_axes.set_xticklabels(labels)
+    self.history_axes.set_ylim(0, max(max(heights) * 1.1, 0.001))
+    self.history_loading.set_visible(False)
+    self.history_canvas.draw_idle()
+
+# Load new daily totals into the history graph, once the History page was built. The scheduler checks the daily
+# totals for changes every HISTORY_REFRESH_INTERVAL secs while the page is shown
+def refresh_history():
+    page = app.frames.get(HistoryPage)
+    if page is None or data_service.busy("history"):
+        return
+    data_service.submit("history", query_history, HOUSEHOLD_ID,
+                        callback=lambda result: result is not None and update_history_diagram(page, *result))
+
 
 class HistoryPage(tk.Frame):
 
@@ -345,7 +743,7 @@ class HistoryPage(tk.Frame):
         frame_top_image.label = Label(frame_top_image, image=frame_top_image.picture, borderwidth=0)
         frame_top_image.label.pack()
 
-        # Add last 10 days History Graph
+        # Add last 10 days History Graph (refresh_history loads its data)
         history_diagram(self)
 
         # Add Menu Buttons
@@ -381,191 +779,69 @@ class HistoryPage(tk.Frame):
         button_menu_profile.place(x=450, y=900)
 
 
+# Per clock hour partials of the longest Insights window and the time the query started - runs on a data service thread
+def query_insights_seed():
+    started = time.time()
+    return started, insights.query_clock_hour_partials(data_service.query_api, os.getenv('INFLUXDB_ORG'), "-730h", HOUSEHOLD_FILTER, INSIGHTS_TIERS)
+
+# Seed (or seed again) the incremental Insights windows and show their statistics
+def seed_insights_windows(result):
+    global insights_seeded
+    global insights_seed_started
+    global insights_seed_time
+    global insights_gap
+    started, rows = result
+    windows = {range_start: insights.SlidingWindowStatistics(hours) for range_start, hours in INSIGHTS_RANGE_HOURS.items()}
+    for window in windows.values():
+        window.seed(rows)
+
+    # Readings until the query started are in the seed already, the newer ones that arrived meanwhile are added
+    for timestamp, value in insights_recent:
+        if timestamp > started:
+            for window in windows.values():
+                window.add(timestamp, value)
+    insights_recent.clear()
+
+    INSIGHTS_WINDOWS.update(windows)
+    insights_seeded = True
+    insights_seed_started = started
+    insights_seed_time = time.monotonic()
+    insights_gap = False
+    refresh_insights()
+
+# Add a live reading to the incremental Insights windows (a reading that is in the seed is skipped)
+def add_insights_reading(timestamp, value):
+    if data_service.busy("insights-seed"):
+        insights_recent.append((timestamp, value))
+    if not insights_seeded or timestamp <= insights_seed_started:
+        return
+    for window in INSIGHTS_WINDOWS.values():
+        window.add(timestamp, value)
+
+# The live feed skipped readings, the incremental Insights windows are seeded again at their next refresh
+def insights_missed_readings():
+    global insights_gap
+    insights_gap = True
+
+# Statistics of a time range: std, max, min and average consumption per morning, noon, afternoon and night
+def query_range_statistics_influxDB(range_start):
+    if insights_cache is not None:
+        now = time.time()
+        return insights.statistics_of_readings(*insights_cache.get(now - INSIGHTS_RANGE_HOURS[range_start] * 3600, now))
+
+    return insights.query_range_statistics(data_service.query_api, os.getenv('INFLUXDB_ORG'), range_start,
+                                           HOUSEHOLD_FILTER, INSIGHTS_AGGREGATION, tiers=INSIGHTS_TIERS)
+
 # Function that is querying the InfluxDB Time Series Database obtaining last 168 hours(week) measurements
 def query_last_week_values_influxDB():
-    # Query script - get last 168 hours(week) measurements
-    query_api = client.query_api()
-    query = 'from(bucket: "electricity")\
-        |> range(start:-168h, stop: now())\
-        |> filter(fn: (r) =>\
-            r._measurement == "electricity"\
-        )'
-
-    # Query InfluxDB database
-    result = query_api.query(org=os.getenv('INFLUXDB_ORG'), query=query)
-    value = []
-    time = []
-    i = 0
-    # Store query results
-    for table in result:
-        for record in table.records:
-            value.append((record.get_value()))
-            time.append((record.get_time()))
-            i = i + 1
-
-    # Convert query results into pandas dataframe
-    measurement = np.vstack((value, time)).T
-    dataframe=pd.DataFrame(measurement, columns=['value', 'time'])
-
-    # Standart deviation
-    std = dataframe.loc[:,"value"].std()
-    # Highest consumption value
-    max = dataframe.loc[:,"value"].max()
-    # Lowest consumption value
-    min = dataframe.loc[:,"value"].min()
-
-    # Average energy consumption per morning, noon, afternoon and night
-    # iterate through each row and select 'time' column respectively
-    morning_sum = 0
-    morning_count = 0
-    noon_sum = 0
-    noon_count = 0
-    afternoon_sum = 0
-    afternoon_count = 0
-    night_sum = 0
-    night_count = 0
-    for ind in dataframe.index:
-        # Get datetime
-        date_time = dataframe['time'][ind]
-        # Get only hour from datetime
-        hour = str(date_time.time())[0:2]
-        hour = int(hour)
-
-        # [06:00 - 11:00] = Morning
-        if hour >= 6 and hour < 12 :
-            morning_sum = morning_sum + dataframe['value'][ind]
-            morning_count = morning_count + 1
-
-        # [12:00 - 17:00] = Noon
-        elif hour >= 12 and hour < 18 :
-            noon_sum = noon_sum + dataframe['value'][ind]
-            noon_count = noon_count + 1
-
-        # [18:00 - 23:00] = Afternoon
-        elif hour >= 18 and hour <= 23:
-            afternoon_sum = afternoon_sum + dataframe['value'][ind]
-            afternoon_count = afternoon_count + 1
-
-        # [00:00 - 05:00] = Night
-        else:
-            night_sum = night_sum + dataframe['value'][ind]
-            night_count = night_count + 1
-
-        # Calculate average consumption per morning, noon, afternoon and night
-        if morning_count > 0 :
-            morning_avg = morning_sum / morning_count
-        else:
-            morning_avg = 0
-
-        if noon_count > 0 :
-            noon_avg = noon_sum / noon_count
-        else:
-            noon_avg = 0
-
-        if afternoon_count > 0 :
-            afternoon_avg = afternoon_sum / afternoon_count
-        else:
-            afternoon_avg = 0
-
-        if night_count > 0 :
-            night_avg = night_sum / night_count
-        else:
-            night_avg = 0
-
-    return std, max, min, morning_avg, noon_avg, afternoon_avg, night_avg
+    return query_range_statistics_influxDB("-168h")
 
 # Function that is querying the InfluxDB Time Series Database obtaining last 730 hours(month) measurements
 def query_last_month_values_influxDB():
-    # Query script - get last 730 hours(month measurements)
-    query_api = client.query_api()
-    query = 'from(bucket: "electricity")\
-        |> range(start:-730h, stop: now())\
-        |> filter(fn: (r) =>\
-            r._measurement == "electricity"\
-        )'
+    return query_range_statistics_influxDB("-730h")
 
-    # Query InfluxDB database
-    result = query_api.query(org=os.getenv('INFLUXDB_ORG'), query=query)
-    value = []
-    time = []
-    i = 0
-    # Store query results
-    for table in result:
-        for record in table.records:
-            value.append((record.get_value()))
-            time.append((record.get_time()))
-            i = i + 1
-
-    # Convert query results into pandas dataframe
-    measurement = np.vstack((value, time)).T
-    dataframe=pd.DataFrame(measurement, columns=['value', 'time'])
-
-    # Standart deviation
-    std = dataframe.loc[:,"value"].std()
-    # Highest consumption value
-    max = dataframe.loc[:,"value"].max()
-    # Lowest consumption value
-    min = dataframe.loc[:,"value"].min()
-
-    # Average energy consumption per morning, noon, afternoon and night
-    # iterate through each row and select 'time' column respectively
-    morning_sum = 0
-    morning_count = 0
-    noon_sum = 0
-    noon_count = 0
-    afternoon_sum = 0
-    afternoon_count = 0
-    night_sum = 0
-    night_count = 0
-    for ind in dataframe.index:
-        # Get datetime
-        date_time = dataframe['time'][ind]
-        # Get only hour from datetime
-        hour = str(date_time.time())[0:2]
-        hour = int(hour)
-
-        # [06:00 - 11:00] = Morning
-        if hour >= 6 and hour < 12 :
-            morning_sum = morning_sum + dataframe['value'][ind]
-            morning_count = morning_count + 1
-
-        # [12:00 - 17:00] = Noon
-        elif hour >= 12 and hour < 18 :
-            noon_sum = noon_sum + dataframe['value'][ind]
-            noon_count = noon_count + 1
-
-        # [18:00 - 23:00] = Afternoon
-        elif hour >= 18 and hour <= 23:
-            afternoon_sum = afternoon_sum + dataframe['value'][ind]
-            afternoon_count = afternoon_count + 1
-
-        # [00:00 - 05:00] = Night
-        else:
-            night_sum = night_sum + dataframe['value'][ind]
-            night_count = night_count + 1
-
-        # Calculate average consumption per morning, noon, afternoon and night
-        if morning_count > 0 :
-            morning_avg = morning_sum / morning_count
-        else:
-            morning_avg = 0
-
-        if noon_count > 0 :
-            noon_avg = noon_sum / noon_count
-        else:
-            noon_avg = 0
-
-        if afternoon_count > 0 :
-            afternoon_avg = afternoon_sum / afternoon_count
-        else:
-            afternoon_avg = 0
-
-        if night_count > 0 :
-            night_avg = night_sum / night_count
-        else:
-            night_avg = 0
-
-    return std, max, min, morning_avg, noon_avg, afternoon_avg, night_avg
+# Shown in the insights table until the first statistics arrive
+PLACEHOLDER = "..."
 
 class InsightsPage(tk.Frame):
     
@@ -587,9 +863,6 @@ class InsightsPage(tk.Frame):
         frame_top_image.label = Label(frame_top_image, image=frame_top_image.picture, borderwidth=0)
         frame_top_image.label.pack()
 
-        # Query InfluxDB database and get last week measurments
-        std_week, max_week, min_week, morning_avg_week, noon_avg_week, afternoon_avg_week, night_avg_week = query_last_week_values_influxDB()
-
         # "Last Week" title
         frame_week = Frame(self, height=40, width=500, bg=DARK_BLUE, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_week.place(x=50, y=140)
@@ -607,7 +880,7 @@ class InsightsPage(tk.Frame):
         frame_week_std_deviation_value = Frame(self, height=50, width=250, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_week_std_deviation_value.place(x=300, y=180)
         str_std_week = StringVar()
-        str_std_week.set(str(round(std_week, 2)))
+        str_std_week.set(PLACEHOLDER)
         label_week_std_deviation_value=tk.Label(frame_week_std_deviation_value, textvariable=str_std_week, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_week_std_deviation_value.pack_propagate(False) 
         label_week_std_deviation_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -622,7 +895,7 @@ class InsightsPage(tk.Frame):
         frame_week_max_value = Frame(self, height=50, width=250, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_week_max_value.place(x=300, y=230)
         str_max_week = StringVar()
-        str_max_week.set(str(max_week))
+        str_max_week.set(PLACEHOLDER)
         label_week_max_value=tk.Label(frame_week_max_value, textvariable=str_max_week, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_week_max_value.pack_propagate(False) 
         label_week_max_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -637,7 +910,7 @@ class InsightsPage(tk.Frame):
         frame_week_min_value = Frame(self, height=50, width=250, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_week_min_value.place(x=300, y=280)
         str_min_week = StringVar()
-        str_min_week.set(str(min_week))
+        str_min_week.set(PLACEHOLDER)
         label_week_min_value=tk.Label(frame_week_min_value, textvariable=str_min_week, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_week_min_value.pack_propagate(False) 
         label_week_min_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -681,7 +954,7 @@ class InsightsPage(tk.Frame):
         frame_week_avg_morning_value = Frame(self, height=50, width=125, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_week_avg_morning_value.place(x=50, y=430)
         str_morning_avg_week = StringVar()
-        str_morning_avg_week.set(str(round(morning_avg_week, 2)))
+        str_morning_avg_week.set(PLACEHOLDER)
         label_week_avg_morning_value=tk.Label(frame_week_avg_morning_value, textvariable=str_morning_avg_week, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_week_avg_morning_value.pack_propagate(False) 
         label_week_avg_morning_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -690,7 +963,7 @@ class InsightsPage(tk.Frame):
         frame_week_avg_noon_value = Frame(self, height=50, width=125, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_week_avg_noon_value.place(x=175, y=430)
         str_noon_avg_week = StringVar()
-        str_noon_avg_week.set(str(round(noon_avg_week, 2)))
+        str_noon_avg_week.set(PLACEHOLDER)
         label_week_avg_noon_value=tk.Label(frame_week_avg_noon_value, textvariable=str_noon_avg_week, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_week_avg_noon_value.pack_propagate(False) 
         label_week_avg_noon_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -699,7 +972,7 @@ class InsightsPage(tk.Frame):
         frame_week_avg_afternoon_value = Frame(self, height=50, width=125, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_week_avg_afternoon_value.place(x=300, y=430)
         str_afternoon_avg_week = StringVar()
-        str_afternoon_avg_week.set(str(round(afternoon_avg_week, 2)))
+        str_afternoon_avg_week.set(PLACEHOLDER)
         label_week_avg_afternoon_value=tk.Label(frame_week_avg_afternoon_value, textvariable=str_afternoon_avg_week, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_week_avg_afternoon_value.pack_propagate(False) 
         label_week_avg_afternoon_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -708,7 +981,7 @@ class InsightsPage(tk.Frame):
         frame_week_avg_night_value = Frame(self, height=50, width=125, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_week_avg_night_value.place(x=425, y=430)
         str_night_avg_week = StringVar()
-        str_night_avg_week.set(str(round(night_avg_week, 2)))
+        str_night_avg_week.set(PLACEHOLDER)
         label_week_avg_night_value=tk.Label(frame_week_avg_night_value, textvariable=str_night_avg_week, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_week_avg_night_value.pack_propagate(False) 
         label_week_avg_night_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -722,9 +995,6 @@ class InsightsPage(tk.Frame):
         global str_afternoon_avg_month
         global str_night_avg_month
 
-        # Query InfluxDB database and get last month measurments
-        std_month, max_month, min_month, morning_avg_month, noon_avg_month, afternoon_avg_month, night_avg_month = query_last_month_values_influxDB()
-
         # "Last Month" title
         frame_last_month_title = Frame(self, height=40, width=500, bg=DARK_BLUE, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_last_month_title.place(x=50, y=510)
@@ -742,7 +1012,7 @@ class InsightsPage(tk.Frame):
         frame_month_std_deviation_value = Frame(self, height=50, width=250, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_month_std_deviation_value.place(x=300, y=550)
         str_std_month = StringVar()
-        str_std_month.set(str(round(std_month, 2)))
+        str_std_month.set(PLACEHOLDER)
         label_month_std_deviation_value=tk.Label(frame_month_std_deviation_value, textvariable=str_std_month, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_month_std_deviation_value.pack_propagate(False) 
         label_month_std_deviation_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -757,7 +1027,7 @@ class InsightsPage(tk.Frame):
         frame_month_max_value = Frame(self, height=50, width=250, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_month_max_value.place(x=300, y=600)
         str_max_month = StringVar()
-        str_max_month.set(str(max_month))
+        str_max_month.set(PLACEHOLDER)
         label_month_max_value=tk.Label(frame_month_max_value, textvariable=str_max_month, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_month_max_value.pack_propagate(False) 
         label_month_max_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -772,7 +1042,7 @@ class InsightsPage(tk.Frame):
         frame_month_min_value = Frame(self, height=50, width=250, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_month_min_value.place(x=300, y=650)
         str_min_month = StringVar()
-        str_min_month.set(str(min_month))
+        str_min_month.set(PLACEHOLDER)
         label_month_min_value=tk.Label(frame_month_min_value, textvariable=str_min_month, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_month_min_value.pack_propagate(False) 
         label_month_min_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -816,7 +1086,7 @@ class InsightsPage(tk.Frame):
         frame_month_avg_morning_value = Frame(self, height=50, width=125, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_month_avg_morning_value.place(x=50, y=800)
         str_morning_avg_month = StringVar()
-        str_morning_avg_month.set(str(round(morning_avg_month, 2)))
+        str_morning_avg_month.set(PLACEHOLDER)
         label_month_avg_morning_value=tk.Label(frame_month_avg_morning_value, textvariable=str_morning_avg_month, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_month_avg_morning_value.pack_propagate(False) 
         label_month_avg_morning_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -825,7 +1095,7 @@ class InsightsPage(tk.Frame):
         frame_month_avg_noon_value = Frame(self, height=50, width=125, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_month_avg_noon_value.place(x=175, y=800)
         str_noon_avg_month = StringVar()
-        str_noon_avg_month.set(str(round(noon_avg_month, 2)))
+        str_noon_avg_month.set(PLACEHOLDER)
         label_month_avg_noon_value=tk.Label(frame_month_avg_noon_value, textvariable=str_noon_avg_month, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_month_avg_noon_value.pack_propagate(False) 
         label_month_avg_noon_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -834,7 +1104,7 @@ class InsightsPage(tk.Frame):
         frame_month_avg_afternoon_value = Frame(self, height=50, width=125, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_month_avg_afternoon_value.place(x=300, y=800)
         str_afternoon_avg_month = StringVar()
-        str_afternoon_avg_month.set(str(round(afternoon_avg_month, 2)))
+        str_afternoon_avg_month.set(PLACEHOLDER)
         label_month_avg_afternoon_value=tk.Label(frame_month_avg_afternoon_value, textvariable=str_afternoon_avg_month, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_month_avg_afternoon_value.pack_propagate(False) 
         label_month_avg_afternoon_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -843,7 +1113,7 @@ class InsightsPage(tk.Frame):
         frame_month_avg_night_value = Frame(self, height=50, width=125, bg=LIGHT_GREY, bd=1, highlightbackground=WHITE, highlightthickness=2, relief=FLAT)
         frame_month_avg_night_value.place(x=425, y=800)
         str_night_avg_month = StringVar()
-        str_night_avg_month.set(str(round(night_avg_month, 2)))
+        str_night_avg_month.set(PLACEHOLDER)
         label_month_avg_night_value=tk.Label(frame_month_avg_night_value, textvariable=str_night_avg_month, font='Helvetica 17 bold', fg=DARK_BLUE, bg=LIGHT_GREY)
         frame_month_avg_night_value.pack_propagate(False) 
         label_month_avg_night_value.place(relx=0.5, rely=0.5, anchor=CENTER)
@@ -881,11 +1151,9 @@ class InsightsPage(tk.Frame):
                                      command=lambda: controller.show_frame(ProfilePage))
         button_menu_profile.place(x=450, y=900)
 
-# Refresh insights table every 20 secs
-def insightsTableRefresher():
-
-    # Update insights table week values
-    std_week, max_week, min_week, morning_avg_week, noon_avg_week, afternoon_avg_week, night_avg_week = query_last_week_values_influxDB()
+# Show last week statistics in the insights table
+def show_week_statistics(statistics):
+    std_week, max_week, min_week, morning_avg_week, noon_avg_week, afternoon_avg_week, night_avg_week = statistics
 
     str_std_week.set(str(round(std_week, 2)))
     str_max_week.set(str(max_week))
@@ -895,9 +1163,10 @@ def insightsTableRefresher():
     str_afternoon_avg_week.set(str(round(afternoon_avg_week, 2)))
     str_night_avg_week.set(str(round(night_avg_week, 2)))
 
-    # Update insights table month values
-    std_month, max_month, min_month, morning_avg_month, noon_avg_month, afternoon_avg_month, night_avg_month = query_last_month_values_influxDB()
-    
+# Show last month statistics in the insights table
+def show_month_statistics(statistics):
+    std_month, max_month, min_month, morning_avg_month, noon_avg_month, afternoon_avg_month, night_avg_month = statistics
+
     str_std_month.set(str(round(std_month, 2)))
     str_max_month.set(str(max_month))
     str_min_month.set(str(min_month))
@@ -906,7 +1175,53 @@ def insightsTableRefresher():
     str_afternoon_avg_month.set(str(round(afternoon_avg_month, 2)))
     str_night_avg_month.set(str(round(night_avg_month, 2)))
 
-    app.after(20000, insightsTableRefresher) # every 20 seconds...
+# Update the insights table. Week and month are queried in parallel on data service threads,
+# a query that is still running from the last refresh isn't started again
+def refresh_insights():
+    if InsightsPage not in app.frames:
+        return
+
+    if INSIGHTS_AGGREGATION == insights.INCREMENTAL:
+        if insights_seeded:
+            show_week_statistics(INSIGHTS_WINDOWS["-168h"].statistics(time.time()))
+            show_month_statistics(INSIGHTS_WINDOWS["-730h"].statistics(time.time()))
+        stale = not insights_seeded or insights_gap or time.monotonic() - insights_seed_time >= INSIGHTS_RESEED_INTERVAL
+        if stale and not data_service.busy("insights-seed"):
+            data_service.submit("insights-seed", query_insights_seed, callback=seed_insights_windows)
+        return
+
+    if not data_service.busy("insights-week"):
+        data_service.submit("insights-week", query_last_week_values_influxDB, callback=show_week_statistics)
+    if not data_service.busy("insights-month"):
+        data_service.submit("insights-month", query_last_month_values_influxDB, callback=show_month_statistics)
+
+# Data service keys of the Insights queries
+def insights_keys():
+    if INSIGHTS_AGGREGATION == insights.INCREMENTAL:
+        return ("insights-seed",)
+    return ("insights-week", "insights-month")
+
+# Register the periodic work with the scheduler, the live chart's frames are ticks of its "live-chart" task
+def schedule_tasks():
+    # Hand finished queries back to the widgets, on the Tk main loop
+    scheduler.add("data-service", data_service.poll, DATA_SERVICE_POLL_INTERVAL)
+
+    # Live readings are collected whatever page is shown, so today's totals and the Insights windows stay complete
+    scheduler.add("live", lambda: request_live_readings(live_readings), LIVE_INTERVAL,
+                  busy=lambda: data_service.busy("live"), latency=lambda: data_service.latency("live"))
+    live_chart_timer = AnimationTimer(int(LIVE_INTERVAL * 1000))
+    scheduler.add("live-chart", live_chart_timer.fire, LIVE_INTERVAL, page=EnergyPage)
+    scheduler.add("usage-table", refresh_usage_table, USAGE_TABLE_INTERVAL, page=EnergyPage)
+
+    # The incremental Insights only query once to seed their windows, refreshing them afterwards is cheap
+    insights_latency = None
+    if INSIGHTS_AGGREGATION != insights.INCREMENTAL:
+        insights_latency = lambda: max(data_service.latency(key) for key in insights_keys())
+    scheduler.add("insights", refresh_insights, INSIGHTS_INTERVAL, page=InsightsPage,
+                  busy=lambda: any(data_service.busy(key) for key in insights_keys()), latency=insights_latency)
+    scheduler.add("history", refresh_history, HISTORY_REFRESH_INTERVAL, page=HistoryPage,
+                  busy=lambda: data_service.busy("history"), latency=lambda: data_service.latency("history"))
+    return live_chart_timer
 
 
 class ProfilePage(tk.Frame):
@@ -973,9 +1288,43 @@ class ProfilePage(tk.Frame):
         button_menu_profile.place(x=450, y=900)
 
 
-app = WattMattersApp()
-ani = animation.FuncAnimation(f, animate, fargs=(xs, ys), interval=1000) #1000 millisec = 1 sec
-usageTableRefresher()
-insightsTableRefresher()
+app = None
+
+def main():
+    global app
+    global data_service
+
+    import matplotlib
+    matplotlib.use("TkAgg")
+    import matplotlib.animation as animation
+    from matplotlib import style
+
+    # Matplotlib style
+    style.use("ggplot")
+    startup_mark("imports")
+
+    data_service = DataService(connect=connect_influxdb, workers=DATA_SERVICE_WORKERS)
+    read_today_totals()
+    create_live_chart()
+
+    app = WattMattersApp()
+    if LIVE_SOURCE == 'mqtt':
+        start_live_subscriber()
+    live_chart_timer = schedule_tasks()
+    if LIVE_CHART_RENDERING == 'blit':
+        ani = animation.FuncAnimation(f, animate_blit, init_func=init_live_chart, fargs=(live_readings,), blit=True, event_source=live_chart_timer)
+    else:
+        ani = animation.FuncAnimation(f, animate, fargs=(live_readings,), event_source=live_chart_timer)
+        f.canvas.mpl_connect('draw_event', frame_drawn)
+    scheduler.start(app.after, app.after_cancel)
+
+    app.mainloop()
+    scheduler.stop()
+    stop_live_subscriber()
+    data_service.close()
+    if history_conn is not None:
+        history_conn.close()
+
 
-app.mainloop()
+if __name__ == "__main__":
+    main()